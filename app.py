@@ -1,34 +1,38 @@
 __author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
 
 # Builtins
+import hmac
 import os
 import sys
+import time
 import logging
 from typing import *
 
 # Libraries
-from flask import Flask, flash, jsonify, request, render_template, session, redirect, url_for, send_from_directory, json  # type: ignore
+import click
+from flask import Blueprint, Flask, current_app, flash, jsonify, request, render_template, session, redirect, url_for, send_from_directory, json  # type: ignore
 from flask_login import LoginManager, UserMixin, login_required, login_user, logout_user, current_user  # type: ignore
 from flask_migrate import Migrate
+from flask.cli import with_appcontext
 
 # Imports
 from backend.responses import *
 from backend.models import *
+from backend.refresher import CalendarRefresher
+from backend.jobs import JobQueue
+from backend import metrics
 
 ###############
 ### GLOBALS ###
 ###############
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
-    'DATABASE_URL', 'sqlite:////tmp/flask_app.db')
-app.config["SECRET_KEY"] = "ITSASECRET"
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+api = Blueprint('api', __name__)
 
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'api.login'
+
+migrate = Migrate()
+jobs = JobQueue()
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -36,17 +40,124 @@ logging.basicConfig(level=logging.DEBUG)
 ### SETUP ###
 #############
 
-# Where db is imported from suq.models
-# http://stackoverflow.com/questions/9692962/flask-sqlalchemy-import-context-issue
-db.init_app(app)
-migrate = Migrate(app, db)
-
-with app.app_context():
+def create_app() -> Flask:
+    """
+    Builds the app, configured from the environment.
+
+    This doesn't touch the database, so that workers boot quickly. Its tables
+    are created by `flask init-db`.
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'DATABASE_URL', 'sqlite:////tmp/flask_app.db')
+    app.config["SECRET_KEY"] = "ITSASECRET"
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['BREAKS_ENGINE'] = os.environ.get('BREAKS_ENGINE', 'python')
+    app.config['ICS_PARSER'] = os.environ.get('ICS_PARSER', 'fast')
+    app.config['WHATS_DUE_CACHE_PATH'] = os.environ.get('WHATS_DUE_CACHE_PATH')
+    app.config['CALENDAR_REFRESH_CONCURRENCY'] = int(os.environ.get('CALENDAR_REFRESH_CONCURRENCY', 4))
+    app.config['CALENDAR_REFRESH_JITTER'] = float(os.environ.get('CALENDAR_REFRESH_JITTER', 5))
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+    # Each open stream holds on to a worker, so only turn this on with an async
+    # gunicorn worker class, like gevent
+    app.config['STATUS_STREAM'] = os.environ.get('STATUS_STREAM', 'off') == 'on'
+    app.config['STATUS_STREAM_HEARTBEAT'] = float(os.environ.get('STATUS_STREAM_HEARTBEAT', 30))
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+    # `/metrics` is only served to scrapers that send this as a bearer token
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    app.config['UQ_URL'] = os.environ.get('UQ_URL')
+    app.config['UQ_COURSES_URL'] = os.environ.get('UQ_COURSES_URL')
+    app.config['TIMETABLE_PLANNER_URL'] = os.environ.get('TIMETABLE_PLANNER_URL')
+
+    login_manager.init_app(app)
+
+    # Where db is imported from suq.models
+    # http://stackoverflow.com/questions/9692962/flask-sqlalchemy-import-context-issue
+    db.init_app(app)
+    migrate.init_app(app, db)
+    jobs.init_app(app)
+    metrics.init_app(app)
+    configure_caches(app.config['WHATS_DUE_CACHE_PATH'])
+    configure_upstreams(app.config['UQ_URL'], app.config['UQ_COURSES_URL'],
+                        app.config['TIMETABLE_PLANNER_URL'])
+
+    app.register_blueprint(api)
+    app.cli.add_command(init_db)
+    app.cli.add_command(backfill_events)
+    app.cli.add_command(refresh_calendars)
+
+    return app
+
+
+####################
+### CLI COMMANDS ###
+####################
+
+@click.command('init-db')
+@with_appcontext
+def init_db() -> None:
+    """
+    Creates any tables that don't exist yet. Run once per deploy, rather than
+    in every worker.
+    """
     logging.info("Creating the database")
     db.create_all()
     db.session.commit()
 
-@app.errorhandler(APIException)
+
+@click.command('backfill-events')
+@with_appcontext
+def backfill_events() -> None:
+    """
+    Explodes the stored calendars of users who added them before the `Events`
+    table existed into said table.
+    """
+    users = User.query.filter(User.calendar_data != None).all()
+
+    for user in users:
+        if user.has_stored_events:
+            continue
+
+        try:
+            user.store_events(user.events)
+            db.session.commit()
+            logging.info(f"Backfilled the events of user {user.id}")
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Could not backfill the events of user {user.id}: {e}")
+
+
+@click.command('refresh-calendars')
+@click.option('--every', type=int, default=None,
+              help="Keep refreshing, waiting this many seconds between runs")
+@with_appcontext
+def refresh_calendars(every: Optional[int]) -> None:
+    """
+    Re-downloads every stored calendar that has changed since it was added.
+    """
+    refresher = CalendarRefresher(concurrency=current_app.config['CALENDAR_REFRESH_CONCURRENCY'],
+                                  jitter=current_app.config['CALENDAR_REFRESH_JITTER'])
+
+    while True:
+        try:
+            stats = refresher.refresh_all()
+            click.echo(json.dumps(stats.to_dict()))
+        except Exception:
+            if every is None:
+                raise
+
+            # A bad run shouldn't take the worker down with it
+            db.session.rollback()
+            logging.exception("Could not refresh calendars")
+
+        if every is None:
+            break
+
+        time.sleep(every)
+
+
+@api.app_errorhandler(APIException)
 def handle_thrown_api_exceptions(error: APIException) -> Response:
     """
     Transforms custom APIExceptions into API error responses.
@@ -59,14 +170,14 @@ def handle_thrown_api_exceptions(error: APIException) -> Response:
     return response
 
 
-@app.after_request
+@api.after_app_request
 def add_header(response: Response) -> Response:
     """
     Add headers to both force latest IE rendering engine or Chrome Frame,
     and also to cache the rendered page for 10 minutes.
     """
     response.headers['X-UA-Compatible'] = 'IE=Edge,chrome=1'
-    response.headers['Cache-Control'] = 'public, max-age=0'
+    response.headers.setdefault('Cache-Control', 'public, max-age=0')
     return response
 
 @login_manager.user_loader
@@ -89,18 +200,18 @@ def load_user(id: str):
 ### STATIC ENDPOINTS ###
 ########################
 
-@app.route('/', methods=['GET'])
+@api.route('/', methods=['GET'])
 def index() -> Response:
-    return app.send_static_file("index.html")
+    return current_app.send_static_file("index.html")
 
 
-@app.route('/app', methods=['GET'])
+@api.route('/app', methods=['GET'])
 @login_required
 def frontend() -> Response:
-    return app.send_static_file("app.html")
+    return current_app.send_static_file("app.html")
 
 
-@app.route('/login', methods=['GET'])
+@api.route('/login', methods=['GET'])
 def login() -> Response:
     if current_user.is_authenticated:
         logging.info("User at login page is logged in")
@@ -119,10 +230,10 @@ def redirect_url() -> Response:
     """
     return request.args.get('next') or \
         request.referrer or \
-        url_for('index')
+        url_for('.index')
 
 
-@app.route('/check-login')
+@api.route('/check-login')
 @login_required
 def check_login() -> Response:
     """
@@ -131,19 +242,19 @@ def check_login() -> Response:
     return redirect(redirect_url())
 
 
-@app.route('/logout')
+@api.route('/logout')
 def logout() -> Response:
     """
     Logs a user out.
     """
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
 ######################
 ### REST ENDPOINTS ###
 ######################
 
-@app.route('/whats-due', methods=['GET'])
+@api.route('/whats-due', methods=['GET'])
 @login_required
 def whats_due() -> Response:
     """
@@ -156,7 +267,7 @@ def whats_due() -> Response:
     return ok(current_user.whats_due)
 
 
-@app.route('/fb-friends', methods=['POST', 'GET'])
+@api.route('/fb-friends', methods=['POST', 'GET'])
 @login_required
 def fb_friends() -> Response:
     """
@@ -167,35 +278,29 @@ def fb_friends() -> Response:
     """
     if request.method == 'POST':
         friends_list_dict = request.json['friends']
-        friends_list = []
-        for friend in friends_list_dict:
-            friends_list.append(friend['id'])
         logging.info("Updating user friends")
-        friends_list_string = ",".join(friends_list)
-        current_user.fb_friends = friends_list_string.encode()
+        current_user.sync_fb_friends(friend['id'] for friend in friends_list_dict)
         db.session.flush()
         db.session.commit()
         logging.info("Update Succeeded")
         return ok("Friends added")
     else:
-        all_users = User.query.all()
+        fb_friends = User.query\
+            .join(FacebookFriend, FacebookFriend.fb_friend_id == User.fb_user_id)\
+            .filter(FacebookFriend.user_id == current_user.id).all()
+        request_statuses = get_request_statuses(current_user.fb_user_id)
+
         friends_info = []
-        friend_ids = current_user.fb_friends.decode()
-        friend_ids = friend_ids.split(",")
-
-        for user in all_users:
-            if user.fb_user_id is not None and (user.fb_user_id != current_user.fb_user_id):
-                friend_info = {
-                    'name': user.username,
-                    'fbId': user.fb_user_id,
-                    'dp': user.profile_picture,
-                    'isFBFriend': user.fb_user_id in friend_ids,
-                    # TODO implement this function
-                    'requestStatus': get_request_status(current_user.fb_user_id, user.fb_user_id)
-                }
-                friends_info.append(friend_info)
-                logging.info(f"Found current user: {current_user.username}'s facebook friend: {user.username}")
-        logging.info(f"Found add friend info: {friends_info}")
+        for user in fb_friends:
+            friend_info = {
+                'name': user.username,
+                'fbId': user.fb_user_id,
+                'dp': user.profile_picture,
+                'isFBFriend': True,
+                'requestStatus': request_statuses.get(user.fb_user_id, "Not Added")
+            }
+            friends_info.append(friend_info)
+        logging.debug(f"Found {len(friends_info)} facebook friends of {current_user.username}")
         sort_weight = {
             "Friends": 1,
             "Accept": 2,
@@ -207,7 +312,7 @@ def fb_friends() -> Response:
         return ok(sorted_list)
 
 
-@app.route('/add-friend', methods=['POST'])
+@api.route('/add-friend', methods=['POST'])
 @login_required
 def add_friend() -> Response:
     """
@@ -242,7 +347,7 @@ def add_friend() -> Response:
             return created("Friend request succeeded!")
 
 
-@app.route('/breaks', methods=['POST'])
+@api.route('/breaks', methods=['POST'])
 @login_required
 def breaks() -> Response:
     """
@@ -260,17 +365,20 @@ def breaks() -> Response:
 
     group_members.add(current_user)
 
-    return ok(get_remaining_shared_breaks_this_week(group_members))
+    breaks = get_remaining_shared_breaks_this_week(group_members)
+    return ok([ i.to_dict() for i in breaks ])
 
 
-@app.route('/calendar', methods=['GET', 'POST', 'DELETE'])
+@api.route('/calendar', methods=['GET', 'POST', 'DELETE'])
 @login_required
 def calendar() -> Response:
     """
     GET:  Extracts this weeks subjects from the calendar for the logged in user
 
     POST: Provides the server with a URL to the logged in user's calendar stored
-            at UQ Timetable planner
+            at UQ Timetable planner. The calendar is downloaded in the
+            background, so this responds with a job to poll at
+            `/calendar/jobs/<job_id>`
 
     DELETE: Deletes the cached calendar URl and data
     """
@@ -278,7 +386,15 @@ def calendar() -> Response:
         if (current_user.calendar_data is None):
             raise NotFound(message="Calendar not yet added")
 
-        return ok(current_user.timetable)
+        # The timetable only changes with the calendar, or the week
+        week = datetime.now(BRISBANE_TIME_ZONE).date().isocalendar()[:2]
+        etag = make_etag("calendar", current_user.id, current_user.calendar_version, week)
+
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        return ok(current_user.timetable, etag=etag)
     elif request.method == 'POST':
         cal_url = request.json['url']
         logging.info("Received calendar from {cal_url}")
@@ -293,21 +409,14 @@ def calendar() -> Response:
         if not is_url_valid(cal_url):
             raise InternalServerError(message="Invalid URL")
 
-        try:
-            current_user.add_calendar(cal_url)
-        except:
-            raise InternalServerError(message="Invalid Calendar")
-
-        # FIXME: Do we need this db.session stuff?
-        # Charlie: Yes, current_user is updating their cal, we need to commit that
-        # Shouldn't it be in `.add_calendar` then? Or does it have to be in the
-        # top level function due to race condition shenanigan stuff
-        db.session.flush()
+        job = start_calendar_import(current_user, cal_url)
         db.session.commit()
+        # The job has to be committed before it's run, so that the worker can see it
+        jobs.submit(run_calendar_import, job.id)
 
-        logging.info(f"Updated calendar {current_user.calendar_url}")
-
-        return created(current_user.timetable)
+        response = accepted(job.to_dict())
+        response.headers['Location'] = url_for('.calendar_job', job_id=job.id)
+        return response
     else:
         current_user.remove_calendar()
         db.session.flush()
@@ -315,7 +424,33 @@ def calendar() -> Response:
         return no_content()
 
 
-@app.route('/profile', methods=['GET'])
+@api.route('/calendar/jobs/<job_id>', methods=['GET'])
+@login_required
+def calendar_job(job_id: str) -> Response:
+    """
+    Reports on an import started by POSTing to `/calendar`. Responds with the
+    job while it is still running, and with the logged in user's timetable
+    once it is done.
+    """
+    job = CalendarImport.query.get(job_id)
+
+    if job is None or job.user_id != current_user.id:
+        raise NotFound(message="No such calendar import")
+
+    job.fail_if_abandoned()
+    db.session.commit()
+
+    if job.status == CalendarImport.FAILED:
+        raise InternalServerError(message=job.error)
+
+    if job.status == CalendarImport.DONE:
+        logging.info(f"Updated calendar {current_user.calendar_url}")
+        return created(current_user.timetable)
+
+    return accepted(job.to_dict())
+
+
+@api.route('/profile', methods=['GET'])
 @login_required
 def profile() -> Response:
     """
@@ -326,7 +461,7 @@ def profile() -> Response:
                "calURL": current_user.calendar_url})
 
 
-@app.route('/settings', methods=['GET', 'POST'])
+@api.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings() -> Response:
     """
@@ -350,7 +485,7 @@ def settings() -> Response:
 
         return make_settings_response(current_user)
 
-@app.route('/status', methods=['GET', 'POST'])
+@api.route('/status', methods=['GET', 'POST'])
 @login_required
 def status() -> Response:
     """
@@ -392,7 +527,7 @@ def status() -> Response:
         return make_status_response(current_user)
 
 
-@app.route('/statuses', methods=['GET'])
+@api.route('/statuses', methods=['GET'])
 @login_required
 def statuses() -> Response:
     """
@@ -409,15 +544,78 @@ def statuses() -> Response:
         "Unavailable": 5,
         "Unknown": 6
     }
-    list_user_info = [user.availability(current_user)
+    # Fixes "now" for the whole request, and remembers the current user's
+    # calendar between friends
+    context = EvaluationContext()
+
+    etag = make_etag("statuses", *get_statuses_version(current_user, confirmed_friends, context))
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    list_user_info = [user.availability(current_user, context)
                       for user in confirmed_friends]
     sorted_list = sorted(
         list_user_info, key=lambda x: sort_weight[x['status']])
-    complete_list = [current_user.availability(current_user)] + sorted_list
-    return ok(complete_list)
+    complete_list = [current_user.availability(current_user, context)] + sorted_list
+    return ok(complete_list, etag=etag)
+
+
+def stream_statuses(user: User,
+                    clock: Callable[[], datetime] = lambda: datetime.now(BRISBANE_TIME_ZONE),
+                    sleep: Callable[[float], None] = time.sleep) -> Iterator[str]:
+    """
+    Yields a server-sent event for the user, and each of their confirmed
+    friends, whenever their status changes, starting with everyone's.
+
+    In between, sleeps until one of them could next change, or for at most
+    `STATUS_STREAM_HEARTBEAT` seconds, so that we notice new friends,
+    calendars and settings, and clients that have gone away.
+    """
+    sent: Dict[str, Tuple[str, str]] = {}
+
+    while True:
+        context = EvaluationContext(clock())
+        members = [user] + user.confirmed_friends
+
+        changed = False
+        for member in members:
+            status = member.get_status(context)
+            if sent.get(member.fb_user_id) != (status['status'], status['statusInfo']):
+                sent[member.fb_user_id] = (status['status'], status['statusInfo'])
+                changed = True
+                yield server_sent_event(status, event="status")
+
+        if not changed:
+            yield ": heartbeat\n\n"
 
+        # Ends the transaction, so that we don't hold a connection while we
+        # sleep, and so that everything is reloaded when we wake up
+        db.session.rollback()
 
-@app.route('/fb-login', methods=['POST'])
+        # Statuses change just after an event starts or ends
+        wake_at = get_next_status_change(members, context) + timedelta(seconds=1)
+        sleep(max(0, min((wake_at - context.now).total_seconds(),
+                         current_app.config['STATUS_STREAM_HEARTBEAT'])))
+
+
+@api.route('/statuses/stream', methods=['GET'])
+@login_required
+def statuses_stream() -> Response:
+    """
+    Pushes the current user's, and their confirmed friends', statuses as they
+    change, as server-sent events.
+
+    When `STATUS_STREAM` is off, answers with a 204, which tells `EventSource`
+    not to reconnect, leaving the client to poll `/statuses`.
+    """
+    if not current_app.config['STATUS_STREAM']:
+        return no_content()
+
+    return event_stream(stream_statuses(current_user._get_current_object()))
+
+
+@api.route('/fb-login', methods=['POST'])
 def fb_login() -> Response:
     """
     Uses the JSON passed to us from the frontend to either 'log in' a user, 
@@ -477,7 +675,7 @@ def fb_login() -> Response:
     # FIXME: Is this functional? Otherwise it should just be an `ok()`
     return ok("Logged user in")
 
-@app.route('/fb-app-id', methods=['GET'])
+@api.route('/fb-app-id', methods=['GET'])
 def fb_app_id() -> Response:
     """
     TODO
@@ -485,6 +683,32 @@ def fb_app_id() -> Response:
     app_id = os.environ.get('FB_APP_ID', '1091049127696748')
     return ok(app_id)
 
+
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint() -> Response:
+    """
+    Request latencies, query counts and times, calendar parse times, and time
+    spent waiting on other servers, across every worker, for Prometheus.
+
+    Only answers requests with an `Authorization: Bearer <METRICS_TOKEN>`
+    header, and doesn't exist at all without a `METRICS_TOKEN`.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        raise NotFound(message="Metrics are turned off")
+
+    given = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+        raise Forbidden(message="Missing or invalid metrics token")
+
+    return Response(metrics.collect(current_app.config['METRICS_DIR']),
+                    mimetype="text/plain; version=0.0.4")
+
+app = create_app()
+"""
+What gunicorn, and `flask`, run
+"""
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     logging.info(f"Running app on port {port}")
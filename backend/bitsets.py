@@ -0,0 +1,94 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+A fixed resolution free/busy engine for finding a group's shared breaks in a
+single week, however big the group.
+
+Each person's week is encoded as a bitmap, held in a plain Python `int`, with a
+bit per `SLOT_MINUTES` slot between `DAY_START_HOUR` and `DAY_END_HOUR` of
+each day, Monday first. A bit is set if the person is busy for any of its
+slot. The group is busy whenever any member is, so a whole tutorial cohort
+is just an OR of their bitmaps away.
+
+Times outside of the day, and events that don't land on slot boundaries,
+are rounded outwards, so this is exact for UQ timetables, but not in general.
+"""
+
+# Builtins
+import re
+from datetime import datetime, timedelta
+from typing import Any, Iterable, List, Tuple
+
+SLOT_MINUTES = 5
+DAY_START_HOUR = 7
+DAY_END_HOUR = 22
+
+SLOTS_PER_DAY = (DAY_END_HOUR - DAY_START_HOUR) * 60 // SLOT_MINUTES
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+SLOT = timedelta(minutes=SLOT_MINUTES)
+
+FREE_RUN = re.compile("(?<=1)0+(?=1)")
+"""
+Free slots with busy slots either side, in a day's bitmap written out with
+its first slot first
+"""
+
+
+def get_week_start(instant: datetime) -> datetime:
+    """
+    Returns midnight on the Monday of the week that `instant` falls in
+    """
+    monday = instant - timedelta(days=instant.weekday())
+    return monday.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def encode_week(periods: Iterable[Any], week_start: datetime) -> int:
+    """
+    Encodes the parts of anything with `start` and `end` datetimes that fall
+    in the week starting at `week_start` as a bitmap of busy slots
+    """
+    periods = list(periods)
+    bitmap = 0
+
+    for day in range(7):
+        day_start = week_start + timedelta(days=day, hours=DAY_START_HOUR)
+        day_end = week_start + timedelta(days=day, hours=DAY_END_HOUR)
+
+        for period in periods:
+            start = max(period.start, day_start)
+            end = min(period.end, day_end)
+            if end <= start:
+                continue
+
+            first = int((start - day_start) // SLOT)
+            last = -int(-(end - day_start) // SLOT) # Rounds up
+            bitmap |= ((1 << (last - first)) - 1) << (day * SLOTS_PER_DAY + first)
+
+    return bitmap
+
+
+def get_gaps(bitmaps: Iterable[int], week_start: datetime) -> List[Tuple[datetime, datetime]]:
+    """
+    Given the bitmaps of a number of people, returns the (start, end) of every
+    gap between the times that any of them are busy, in order.
+
+    Like `intervals.get_gaps`, there's nothing before anyone's first slot, or
+    after anyone's last, of each day.
+    """
+    busy = 0
+    for bitmap in bitmaps:
+        busy |= bitmap
+
+    gaps = []
+    for day in range(7):
+        day_bits = (busy >> (day * SLOTS_PER_DAY)) & DAY_MASK
+        if day_bits == 0:
+            continue
+
+        day_start = week_start + timedelta(days=day, hours=DAY_START_HOUR)
+        slots = format(day_bits, f"0{SLOTS_PER_DAY}b")[::-1]
+
+        for run in FREE_RUN.finditer(slots):
+            gaps.append((day_start + run.start() * SLOT, day_start + run.end() * SLOT))
+
+    return gaps
@@ -0,0 +1,187 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Small, dependency-free caches shared by the business logic.
+
+Everything in here is process-wide, so each gunicorn worker gets its own
+copy, except for `DiskTTLCache`, which workers on the same machine share.
+"""
+
+# Builtins
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def content_hash(data: Any) -> str:
+    """
+    Returns a stable hex digest of a `bytes` or `str` blob, suitable as a
+    cache key for data that is stored verbatim in the database
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe, least-recently-used cache that keeps hit and miss
+    counters so that we can tell whether it is earning its keep
+    """
+
+    def __init__(self, maxsize: int = 128) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for `key`, calling `compute` and caching its
+        result on a miss. Exceptions raised by `compute` are not cached.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return { "hits": self.hits, "misses": self.misses,
+                 "size": len(self._entries), "maxsize": self.maxsize }
+
+
+class TTLCache(object):
+    """
+    A bounded, thread-safe, in-process cache whose entries expire `ttl`
+    seconds after they were put
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = LRUCache(maxsize)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            expires_at, value = entry
+            if self.clock() < expires_at:
+                self.hits += 1
+                return value
+
+            self._entries.invalidate(key)
+
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._entries.put(key, (self.clock() + self.ttl, value))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class DiskTTLCache(object):
+    """
+    A `TTLCache` backed by an SQLite file, so that every gunicorn worker on a
+    machine can share it. Keys must be strings, and values must be JSON
+    serializable.
+    """
+
+    def __init__(self, path: str, namespace: str, ttl: float, maxsize: int = 1024,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{namespace}" '
+                         '(key TEXT PRIMARY KEY, expires_at REAL, value TEXT)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections can't be shared between threads, so we make a new
+        # one each time. They're cheap.
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key: str) -> Optional[Any]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(f'SELECT value FROM "{self.namespace}" '
+                               'WHERE key = ? AND expires_at > ?',
+                               (key, self.clock())).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        now = self.clock()
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f'INSERT OR REPLACE INTO "{self.namespace}" VALUES (?, ?, ?)',
+                         (key, now + self.ttl, json.dumps(value)))
+            conn.execute(f'DELETE FROM "{self.namespace}" WHERE expires_at <= ?', (now, ))
+            conn.execute(f'DELETE FROM "{self.namespace}" WHERE key NOT IN '
+                         f'(SELECT key FROM "{self.namespace}" '
+                         'ORDER BY expires_at DESC LIMIT ?)', (self.maxsize, ))
+
+    def clear(self) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f'DELETE FROM "{self.namespace}"')
+        self.hits = 0
+        self.misses = 0
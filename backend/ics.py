@@ -0,0 +1,206 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+A streaming, line-oriented reader for the handful of `VEVENT` properties we
+actually use.
+
+`icalendar` builds a tree of every component and property in a calendar,
+most of which (`UID`s, `DTSTAMP`s, `SEQUENCE`s, ...) we throw away straight
+after. This reads one content line at a time instead, and only parses
+`SUMMARY`, `LOCATION`, `DTSTART` and `DTEND`.
+
+See https://tools.ietf.org/html/rfc5545#section-3.1
+"""
+
+# Builtins
+import io
+import re
+from datetime import date, datetime, timezone, tzinfo
+from typing import IO, Dict, Iterator, List, Optional, Tuple, Union
+
+# Libraries
+from dateutil import tz # type: ignore
+
+RawEvent = Tuple[Optional[str], Optional[str], Union[datetime, date], Union[datetime, date]]
+"""
+A `VEVENT`'s `SUMMARY`, `LOCATION`, `DTSTART` and `DTEND`
+"""
+
+PROPERTIES = { "SUMMARY", "LOCATION", "DTSTART", "DTEND" }
+
+NAME = re.compile(r"[^:;]*")
+
+ESCAPES = { "\\\\": "\\", "\\;": ";", "\\,": ",", "\\n": "\n", "\\N": "\n" }
+
+TIME_ZONES: Dict[str, Optional[tzinfo]] = {}
+"""
+`TZID`s to time zones, as looking them up reads the zoneinfo database
+"""
+
+
+class ICSError(ValueError):
+    """
+    The calendar is malformed, or uses something we don't understand
+    """
+
+
+def unfold(stream: IO[bytes]) -> Iterator[str]:
+    """
+    Joins folded lines back into whole content lines, skipping blank ones
+    """
+    current: Optional[bytes] = None
+
+    for raw in stream:
+        line = raw.rstrip(b"\r\n")
+
+        if line[:1] in (b" ", b"\t"):
+            if current is None:
+                raise ICSError("The calendar starts with a folded line")
+            current += line[1:]
+            continue
+
+        if current:
+            yield current.decode("utf-8", "replace")
+        current = line
+
+    if current:
+        yield current.decode("utf-8", "replace")
+
+
+def split_content_line(line: str) -> Tuple[str, Dict[str, str], str]:
+    """
+    Splits a content line into its name, its parameters and its value
+    """
+    params: Dict[str, str] = {}
+    quoted = False
+
+    # The value starts after the first colon that isn't in a quoted parameter
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ":" and not quoted:
+            break
+    else:
+        raise ICSError(f"Content line without a value: {line!r}")
+
+    name, *rest = line[:i].split(";")
+    for param in rest:
+        key, _, value = param.partition("=")
+        params[key.upper()] = value.strip('"')
+
+    return name.upper(), params, line[i + 1:]
+
+
+def unescape(text: str) -> str:
+    if "\\" not in text:
+        return text
+
+    chars = []
+    i = 0
+    while i < len(text):
+        pair = text[i:i + 2]
+        if pair in ESCAPES:
+            chars.append(ESCAPES[pair])
+            i += 2
+        else:
+            chars.append(text[i])
+            i += 1
+
+    return "".join(chars)
+
+
+def get_time_zone(tzid: str) -> Optional[tzinfo]:
+    if tzid not in TIME_ZONES:
+        TIME_ZONES[tzid] = tz.gettz(tzid)
+    return TIME_ZONES[tzid]
+
+
+def parse_date_time(value: str, params: Dict[str, str]) -> Union[datetime, date]:
+    """
+    Parses a `DATE` or `DATE-TIME` value. Like `icalendar`, times with an
+    unknown `TZID` are left naive.
+    """
+    try:
+        if params.get("VALUE") == "DATE" or len(value) == 8:
+            return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+        if len(value) not in (15, 16) or value[8] != "T":
+            raise ValueError
+
+        instant = datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                           int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    except ValueError:
+        raise ICSError(f"Invalid date: {value!r}")
+
+    if value.endswith("Z"):
+        return instant.replace(tzinfo=timezone.utc)
+
+    if "TZID" in params:
+        zone = get_time_zone(params["TZID"])
+        if zone is not None:
+            return instant.replace(tzinfo=zone)
+
+    return instant
+
+
+def iter_events(stream: IO[bytes]) -> Iterator[RawEvent]:
+    """
+    Yields the `RawEvent` of each `VEVENT` in a calendar as it is read.
+    Properties of components nested in a `VEVENT`, like `VALARM`s, are ignored.
+
+    Throws an `ICSError` if the calendar is malformed.
+    """
+    components: List[str] = []
+    found_calendar = False
+    event: Dict[str, str] = {}
+    params: Dict[str, Dict[str, str]] = {}
+
+    for line in unfold(stream):
+        # Only the properties we care about get split up and parsed
+        name = NAME.match(line).group().upper()
+
+        if name == "BEGIN":
+            component = line[6:].strip().upper()
+            if not components and component != "VCALENDAR":
+                raise ICSError(f"Expected a VCALENDAR, but found a {component}")
+            components.append(component)
+            found_calendar = True
+
+            if component == "VEVENT":
+                event = {}
+                params = {}
+
+        elif name == "END":
+            component = line[4:].strip().upper()
+            if not components or components.pop() != component:
+                raise ICSError(f"Unexpected END:{component}")
+
+            if component == "VEVENT":
+                if "DTSTART" not in event or "DTEND" not in event:
+                    raise ICSError("A VEVENT is missing its DTSTART or DTEND")
+
+                summary = event.get("SUMMARY")
+                location = event.get("LOCATION")
+                yield (unescape(summary) if summary is not None else None,
+                       unescape(location) if location is not None else None,
+                       parse_date_time(event["DTSTART"], params["DTSTART"]),
+                       parse_date_time(event["DTEND"], params["DTEND"]))
+
+        elif not components:
+            raise ICSError(f"Content line outside of a VCALENDAR: {line!r}")
+
+        elif name in PROPERTIES and components[-1] == "VEVENT":
+            name, params[name], event[name] = split_content_line(line)
+
+    if components:
+        raise ICSError(f"Unterminated {components[-1]}")
+
+    if not found_calendar:
+        raise ICSError("No VCALENDAR found")
+
+
+def parse_events(data: bytes) -> List[RawEvent]:
+    """
+    Reads every `VEVENT` out of a calendar blob
+    """
+    return list(iter_events(io.BytesIO(data)))
@@ -0,0 +1,72 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+A vectorized free/busy engine for finding the gaps between large numbers of
+events, such as when a big group tries to find a time to meet.
+
+Events are encoded as NumPy arrays of start and end epoch seconds. NumPy is an
+optional dependency, so check `NUMPY_AVAILABLE` before calling in here. It's
+also slow to import, so it's only imported once something here is called.
+"""
+
+# Builtins
+import importlib.util
+from typing import Any, Iterable, List, Tuple
+
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+Busy = Tuple[Any, Any]
+"""
+A pair of equally sized int64 arrays, holding the start and end epoch seconds
+of a set of events
+"""
+
+
+def encode(periods: Iterable[Any]) -> Busy:
+    """
+    Encodes anything with `start` and `end` datetimes as a `Busy` pair
+    """
+    import numpy as np # type: ignore
+
+    pairs = [ (int(i.start.timestamp()), int(i.end.timestamp())) for i in periods ]
+    encoded = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    return encoded[:, 0], encoded[:, 1]
+
+
+def get_gaps(calendars: List[Busy]) -> List[Tuple[int, int]]:
+    """
+    Given the busy times of a number of people, returns the (start, end) epoch
+    seconds of every gap in the union of them, in order.
+
+    Only gaps *between* events are returned, so there's nothing before the first
+    event or after the last. Events that touch are considered to overlap.
+    """
+    import numpy as np # type: ignore
+
+    if calendars == []:
+        return []
+
+    starts = np.concatenate([ i[0] for i in calendars ])
+    ends = np.concatenate([ i[1] for i in calendars ])
+
+    if len(starts) < 2:
+        return []
+
+    # Each start opens a busy period and each end closes one. Sorting the
+    # lot, with starts first on ties so that touching events merge, makes the
+    # running sum the number of events in progress after each instant
+    times = np.concatenate([ starts, ends ])
+    kinds = np.concatenate([ np.zeros(len(starts), dtype=np.int8),
+                             np.ones(len(ends), dtype=np.int8) ])
+    order = np.lexsort((kinds, times))
+    times = times[order]
+    in_progress = np.cumsum(np.where(kinds[order] == 0, 1, -1))
+
+    # Everyone's free straight after an instant that leaves nothing in
+    # progress, until the next instant, unless that was the very last one
+    free_from = np.nonzero(in_progress[:-1] == 0)[0]
+    gaps = np.stack([ times[free_from], times[free_from + 1] ], axis=1)
+    gaps = gaps[gaps[:, 0] < gaps[:, 1]]
+
+    return [ (int(start), int(end)) for start, end in gaps ]
+
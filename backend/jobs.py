@@ -0,0 +1,76 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Runs slow work, like downloading calendars, on a thread pool so that it
+doesn't tie up the (synchronous) Gunicorn worker that received the request.
+
+Jobs should record their progress in the database, rather than in memory, so
+that any worker can report on them.
+"""
+
+# Builtins
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional, Set
+
+# Libraries
+from flask import Flask
+
+
+class JobQueue(object):
+    """
+    A pool of `JOB_WORKERS` threads that run jobs inside an app context of the
+    app passed to `init_app`.
+    """
+
+    def __init__(self, app: Optional[Flask] = None) -> None:
+        self.app: Optional[Flask] = None
+        self.pool: Optional[ThreadPoolExecutor] = None
+        self._pending: Set[Future] = set()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.pool = ThreadPoolExecutor(max_workers=app.config.get('JOB_WORKERS', 4))
+
+    def submit(self, func: Callable[..., Any], *args: Any) -> Future:
+        """
+        Schedules `func(*args)`. Exceptions are logged, and left on the
+        returned `Future`.
+        """
+        assert self.app is not None and self.pool is not None, "JobQueue.init_app wasn't called"
+
+        def run() -> Any:
+            with self.app.app_context():
+                try:
+                    return func(*args)
+                except Exception:
+                    logging.exception(f"Job {func.__name__}{args} failed")
+                    raise
+
+        future = self.pool.submit(run)
+
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+
+        return future
+
+    def _discard(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits for every job submitted so far to finish, returning whether they
+        all did within `timeout` seconds
+        """
+        with self._lock:
+            pending = set(self._pending)
+
+        _, not_done = wait(pending, timeout=timeout)
+        return not not_done
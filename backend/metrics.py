@@ -0,0 +1,309 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Counters and latency histograms of where our time goes, served up in the
+Prometheus text format.
+
+Each gunicorn worker keeps its own `Registry`. Given a `METRICS_DIR`, each
+also writes a snapshot of its registry to `<pid>.json` in there, at most once
+every `FLUSH_INTERVAL` seconds, and `/metrics` adds up every live worker's
+latest snapshot, so that whichever worker answers reports on the whole dyno.
+Snapshots left behind by workers that have exited are skipped, and cleared
+out whenever a worker starts.
+
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+# Builtins
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Libraries
+import sqlalchemy
+from flask import Flask, Response, g, has_request_context, request
+
+Labels = Tuple[Tuple[str, str], ...]
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""
+Upper bounds, in seconds, of the latency histograms' buckets
+"""
+
+FLUSH_INTERVAL = 1.0
+
+METRICS = {
+    "suq_http_request_duration_seconds":
+        ("histogram", "Time spent answering requests, by endpoint"),
+    "suq_db_queries_total":
+        ("counter", "SQL statements run, by the endpoint that ran them"),
+    "suq_db_query_duration_seconds_total":
+        ("counter", "Time spent running SQL statements, by the endpoint that ran them"),
+    "suq_ics_parse_duration_seconds":
+        ("histogram", "Time spent parsing calendars, by parser"),
+    "suq_outbound_request_duration_seconds":
+        ("histogram", "Time spent waiting on other servers, by who we asked"),
+}
+"""
+The type and help text of everything we measure
+"""
+
+
+class Registry(object):
+    """
+    A thread-safe collection of counters and histograms, each identified by a
+    name and a set of labels
+    """
+
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """
+        Records `value` in a histogram, kept as a count per bucket (and one
+        for everything above the last), followed by the sum of every value
+        """
+        key = (name, tuple(sorted(labels.items())))
+        bucket = next((i for i, bound in enumerate(BUCKETS) if value <= bound), len(BUCKETS))
+
+        with self._lock:
+            histogram = self.histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+            histogram[bucket] += 1
+            histogram[-1] += value
+
+    def clear(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> Dict[str, list]:
+        """
+        A JSON serializable copy of everything in the registry
+        """
+        with self._lock:
+            return { "counters": [ [ name, labels, value ]
+                                   for (name, labels), value in self.counters.items() ],
+                     "histograms": [ [ name, labels, list(values) ]
+                                     for (name, labels), values in self.histograms.items() ] }
+
+    def merge(self, snapshot: Dict[str, list]) -> None:
+        """
+        Adds the values in another registry's `snapshot` to this one's
+        """
+        with self._lock:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(i) for i in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(tuple(i) for i in labels))
+                histogram = self.histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+                for i, value in enumerate(values):
+                    histogram[i] += value
+
+    def render(self) -> str:
+        """
+        Writes out the registry in the Prometheus text format
+        """
+        def format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+            pairs = [ f'{key}="{value}"' for key, value in labels ]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in sorted(METRICS.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+
+                for (metric, labels), values in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+
+                    # Prometheus' buckets are cumulative
+                    total = 0
+                    bounds = [ repr(i) for i in BUCKETS ] + [ "+Inf" ]
+                    for bound, count in zip(bounds, values):
+                        total += count
+                        le = format_labels(labels + (("le", bound), ))
+                        lines.append(f"{name}_bucket{le} {total}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {values[-1]}")
+                    lines.append(f"{name}_count{format_labels(labels)} {total}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+_last_flush = 0.0
+
+
+@contextmanager
+def timed(name: str, **labels: str) -> Iterator[None]:
+    """
+    Records how long the `with` block takes in the histogram `name`, whether
+    or not it throws
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - start, **labels)
+
+
+def get_endpoint() -> str:
+    """
+    The endpoint of the request being answered, if any, to label metrics with
+    """
+    if not has_request_context():
+        return "none"
+    if request.endpoint is None:
+        return "unmatched"
+    # Without the blueprint, so that labels don't change when routes move
+    return request.endpoint.rsplit(".", 1)[-1]
+
+
+def flush(directory: Optional[str], force: bool = False) -> None:
+    """
+    Writes this worker's snapshot to `directory`, unless we did so less than
+    `FLUSH_INTERVAL` seconds ago
+    """
+    global _last_flush
+
+    if directory is None or (not force and time.monotonic() - _last_flush < FLUSH_INTERVAL):
+        return
+
+    _last_flush = time.monotonic()
+    path = os.path.join(directory, f"{os.getpid()}.json")
+
+    # Written to the side, then renamed, so readers never see half a file
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def is_alive(pid: int) -> bool:
+    """
+    Whether there's a process with the given id, whoever it belongs to
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def get_stale_snapshots(directory: str) -> Iterator[str]:
+    """
+    The paths of snapshots in `directory` written by workers that have exited
+    """
+    for name in os.listdir(directory):
+        pid = name[:-len(".json")]
+        if name.endswith(".json") and pid.isdigit() and not is_alive(int(pid)):
+            yield os.path.join(directory, name)
+
+
+def collect(directory: Optional[str]) -> str:
+    """
+    Every worker's metrics, added up, in the Prometheus text format. This
+    worker's are always up to date, and everyone else's are as of their last
+    `flush`.
+    """
+    total = Registry()
+    total.merge(REGISTRY.snapshot())
+
+    if directory is not None:
+        stale = set(get_stale_snapshots(directory))
+
+        for name in os.listdir(directory):
+            if not name.endswith(".json") or name == f"{os.getpid()}.json" or \
+                    os.path.join(directory, name) in stale:
+                continue
+
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    total.merge(json.load(f))
+            except (OSError, ValueError):
+                continue # The worker went away, or is halfway through a write
+
+    return total.render()
+
+
+def before_cursor_execute(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+    # A connection runs one statement at a time. This isn't called for
+    # statements that raise, so the next one just overwrites it.
+    conn.info["query_started_at"] = time.perf_counter()
+
+
+def after_cursor_execute(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+    started_at = conn.info.pop("query_started_at", None)
+    if started_at is None:
+        return
+
+    elapsed = time.perf_counter() - started_at
+    endpoint = get_endpoint()
+    REGISTRY.inc("suq_db_queries_total", endpoint=endpoint)
+    REGISTRY.inc("suq_db_query_duration_seconds_total", elapsed, endpoint=endpoint)
+
+
+def init_app(app: Flask) -> None:
+    """
+    Times every request to `app`, and every SQL statement run by any engine,
+    and sets up the `METRICS_DIR`, if there is one, for sharing them
+    """
+    directory = app.config.get('METRICS_DIR')
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+        # Left by the workers of an earlier deploy, or that gunicorn recycled
+        for path in get_stale_snapshots(directory):
+            try:
+                os.remove(path)
+            except OSError:
+                pass # Another worker got to it first
+
+    if not sqlalchemy.event.contains(sqlalchemy.engine.Engine, "before_cursor_execute",
+                                     before_cursor_execute):
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, "before_cursor_execute",
+                                before_cursor_execute)
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, "after_cursor_execute",
+                                after_cursor_execute)
+
+    @app.before_request
+    def start_timer() -> None:
+        g.request_started_at = time.perf_counter()
+
+    def record_request(status: int) -> None:
+        started_at = g.pop("request_started_at", None)
+        if started_at is not None:
+            REGISTRY.observe("suq_http_request_duration_seconds",
+                             time.perf_counter() - started_at,
+                             endpoint=get_endpoint(), method=request.method,
+                             status=str(status))
+            flush(app.config.get('METRICS_DIR'))
+
+    @app.after_request
+    def record_response(response: Response) -> Response:
+        record_request(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failure(exc: Optional[BaseException]) -> None:
+        # `after_request` doesn't run when a view throws, so those requests
+        # are only recorded here
+        record_request(500)
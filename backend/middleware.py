@@ -1,52 +1,206 @@
 import logging
 import re
-import urllib.request
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone, timedelta, date
-from typing import List, Tuple, Dict, Optional, Set
+from typing import Any, List, Tuple, Dict, Optional, Set
 
-from bs4 import BeautifulSoup # type: ignore
+from backend import metrics
+from backend.caches import TTLCache, DiskTTLCache
 
 BRISBANE_TIME_ZONE = timezone(timedelta(hours=10))
 
-def get_whats_due(subjects: Set[str]) -> List[Dict[str, str]]:
+REQUEST_TIMEOUT = (3.05, 5)
+"""
+Connect and read timeouts, in seconds, for each request to UQ
+"""
+
+WHATS_DUE_DEADLINE = 8
+"""
+How long, in seconds, `get_whats_due` waits on UQ before giving up on any
+courses it hasn't heard back about
+"""
+
+HTTP: Any = None
+"""
+A keep-alive connection pool shared by every outbound request to UQ. Made by
+`get_http` on the first request, as `requests` is slow to import.
+"""
+
+_http_lock = threading.Lock()
+
+UQ_URL = "https://www.uq.edu.au"
+UQ_COURSES_URL = "https://www.courses.uq.edu.au"
+TIMETABLE_PLANNER_URL = "https://timetableplanner.app.uq.edu.au"
+"""
+Where we find course pages, assessment tables and shared calendars. See
+`configure_upstreams`.
+"""
+
+FETCH_POOL = ThreadPoolExecutor(max_workers=16)
+"""
+Bounds how many requests to UQ are in flight at once, across all requests
+"""
+
+PROFILE_ID_TTL = 7 * 24 * 60 * 60
+ASSESSMENT_TTL = 60 * 60
+
+PROFILE_IDS: Any = TTLCache(ttl=PROFILE_ID_TTL)
+"""
+Course codes to UQ course profile ids. These only change between semesters.
+"""
+
+ASSESSMENTS: Any = TTLCache(ttl=ASSESSMENT_TTL)
+"""
+Course profile ids to the rows of their assessment table
+"""
+
+def configure_caches(path: Optional[str] = None) -> None:
     """
-    Takes a list of course codes, finds their course profile id numbers, parses
-    UQ's PHP gateway, then returns the coming assessment.
+    Swaps the caches of UQ's course data for ones shared between processes,
+    stored in an SQLite file at `path`. `None` means in-process caches.
+    """
+    global PROFILE_IDS, ASSESSMENTS
+
+    if path is None:
+        PROFILE_IDS = TTLCache(ttl=PROFILE_ID_TTL)
+        ASSESSMENTS = TTLCache(ttl=ASSESSMENT_TTL)
+    else:
+        PROFILE_IDS = DiskTTLCache(path, "profile_ids", ttl=PROFILE_ID_TTL)
+        ASSESSMENTS = DiskTTLCache(path, "assessments", ttl=ASSESSMENT_TTL)
+
+def configure_upstreams(uq: Optional[str] = None, uq_courses: Optional[str] = None,
+                        timetable_planner: Optional[str] = None) -> None:
+    """
+    Points our requests to UQ, and to Timetable Planner, at other servers,
+    like `bench.standin`. `None` means the real thing.
+    """
+    global UQ_URL, UQ_COURSES_URL, TIMETABLE_PLANNER_URL
+
+    UQ_URL = (uq or "https://www.uq.edu.au").rstrip("/")
+    UQ_COURSES_URL = (uq_courses or "https://www.courses.uq.edu.au").rstrip("/")
+    TIMETABLE_PLANNER_URL = (timetable_planner or "https://timetableplanner.app.uq.edu.au").rstrip("/")
+
+def get_calendar_download_url(url: str) -> str:
+    """
+    Where to download the calendar shared at `url` from. That's `url` itself,
+    unless it's on Timetable Planner, and we've been pointed elsewhere.
+    """
+    for prefix in ("https://timetableplanner.app.uq.edu.au", "http://timetableplanner.app.uq.edu.au"):
+        if url.startswith(prefix + "/"):
+            return TIMETABLE_PLANNER_URL + url[len(prefix):]
+    return url
+
+def get_http() -> Any:
+    """
+    The shared connection pool, `HTTP`, made on first use
+    """
+    global HTTP
+
+    with _http_lock:
+        if HTTP is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+            session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+            HTTP = session
+
+    return HTTP
+
+def fetch(url: str) -> str:
+    """
+    GETs the page at the given URL using the shared connection pool
+    """
+    with metrics.timed("suq_outbound_request_duration_seconds", target="uq"):
+        response = get_http().get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.content.decode('utf-8', 'ignore')
+
+def get_profile_id(course: str) -> Optional[str]:
     """
-    course_url = 'https://www.uq.edu.au/study/course.html?course_code='
-    assessment_url = 'https://www.courses.uq.edu.au/student_section_report' +\
+    Finds the course profile id number of a course code, by scraping its
+    course page
+    """
+    course_url = f'{UQ_URL}/study/course.html?course_code='
+
+    profile_id = PROFILE_IDS.get(course)
+    if profile_id is not None:
+        return profile_id
+
+    try:
+        html = fetch(course_url + course)
+    except Exception as e:
+        logging.warning(f"Could not fetch the course page of {course}: {e}")
+        return None  # Ignore in the case of failure
+
+    match = re.search(r'profileId=(\d+)', html)
+    if match is None:
+        return None
+
+    profile_id = match.group(1)
+    PROFILE_IDS.put(course, profile_id)
+    return profile_id
+
+def get_assessment(profile_id: str) -> List[List[str]]:
+    """
+    Parses UQ's PHP gateway for the rows of a course profile's assessment table
+    """
+    assessment_url = f'{UQ_COURSES_URL}/student_section_report' +\
         '.php?report=assessment&profileIds='
 
-    courses_id = []
-    for course in subjects:
-        try:
-            response = urllib.request.urlopen(course_url + course.upper())
-            html = response.read().decode('utf-8')
-        except:
-            continue  # Ignore in the case of failure
-        try:
-            profile_id_regex = re.compile('profileId=\d*')
-            profile_id = profile_id_regex.search(html).group()
-            if profile_id != None:
-                # Slice to strip the 'profileID='
-                courses_id.append(profile_id[10:])
-        except:
-            continue  # Ignore in the case of failure
-
-    courses = ",".join(courses_id)
-    response = urllib.request.urlopen(assessment_url + courses)
-    html = response.read().decode('utf-8','ignore')
+    rows = ASSESSMENTS.get(profile_id)
+    if rows is not None:
+        return rows
+
+    # Slow to import, along with html5lib, so left until we first need it
+    from bs4 import BeautifulSoup # type: ignore
+
+    html = fetch(assessment_url + profile_id)
     html = re.sub('<br />', ' ', html)
 
     soup = BeautifulSoup(html, "html5lib")
     table = soup.find('table', attrs={'class': 'tblborder'})
-    rows = table.find_all('tr')[1:]  # ignore the top row of the table
+
+    rows = [ [ ele.text.strip() for ele in row.find_all('td') ]
+             for row in table.find_all('tr')[1:] ] # ignore the top row of the table
+
+    ASSESSMENTS.put(profile_id, rows)
+    return rows
+
+def get_whats_due(subjects: Set[str]) -> List[Dict[str, str]]:
+    """
+    Takes a list of course codes, finds their course profile id numbers, parses
+    UQ's PHP gateway, then returns the coming assessment.
+
+    Both the profile ids and the assessment tables are cached, as most of our
+    users share courses. Courses are looked up concurrently, and any that fail,
+    or don't finish within `WHATS_DUE_DEADLINE`, are left out.
+    """
+    def get_course_assessment(course: str) -> List[List[str]]:
+        profile_id = get_profile_id(course.upper())
+        if profile_id is None:
+            return []
+        return get_assessment(profile_id)
+
+    courses = sorted(subjects)
+    futures = [ FETCH_POOL.submit(get_course_assessment, i) for i in courses ]
+    wait(futures, timeout=WHATS_DUE_DEADLINE)
+
+    rows = []
+    for course, future in zip(courses, futures):
+        if not future.done():
+            future.cancel()
+            logging.warning(f"Gave up waiting on the assessment of {course}")
+        elif future.exception() is not None:
+            logging.warning(f"Could not get the assessment of {course}: {future.exception()}")
+        else:
+            rows.extend(future.result())
 
     due_soon = []
     passed_due_date = []
-    for row in rows:
-        cols = [ ele.text.strip() for ele in row.find_all('td') ]
-
+    for cols in rows:
         subject = cols[0].split(" ")[0] # Strip out irrelevant BS about the subject
         date = cols[2]
 
@@ -82,4 +236,4 @@ def get_whats_due(subjects: Set[str]) -> List[Dict[str, str]]:
             due_soon.append(make_assessment_piece(False))
     # For block ends here
 
-    return due_soon + passed_due_date
\ No newline at end of file
+    return due_soon + passed_due_date
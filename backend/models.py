@@ -2,20 +2,32 @@ __author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
 
 # Builtins
 import logging
+import sys
+import uuid
+import heapq
+from bisect import bisect_left, bisect_right
 from itertools import *
 import urllib.request
-from typing import List, Dict, Any, Optional, Iterable, Set, cast
+from typing import List, Dict, Any, Optional, Iterable, Set, Callable, Tuple, cast, TYPE_CHECKING
 from datetime import datetime, timezone, timedelta, date
-from collections import deque
 
 # Libraries
 import flask_login
+from flask import current_app, has_app_context
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy # type: ignore
-from icalendar import Calendar, Event # type: ignore
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+
+if TYPE_CHECKING:
+    # Slow to import, and only needed by the strict parser, so it's imported
+    # where it's used
+    from icalendar import Calendar # type: ignore
 
 # Imports
 from backend.middleware import *
+from backend.caches import LRUCache, content_hash
+from backend import bitsets, intervals, ics, metrics
 
 #################
 ### CONSTANTS ###
@@ -23,6 +35,22 @@ from backend.middleware import *
 
 BRISBANE_TIME_ZONE = timezone(timedelta(hours=10))
 
+Block = Tuple[datetime, datetime]
+"""
+The start and end of a block of busy time
+"""
+
+CALENDAR_DOWNLOAD_TIMEOUT = 10
+"""
+How long, in seconds, we wait on Timetable Planner when downloading a calendar
+"""
+
+CALENDAR_IMPORT_TIMEOUT = 2 * 60
+"""
+How long, in seconds, a `CalendarImport` can be running before we decide that
+the worker running it died, and give up on it
+"""
+
 ###############
 ### GLOBALS ###
 ###############
@@ -32,14 +60,43 @@ db = SQLAlchemy()
 # http://stackoverflow.com/questions/9692962/flask-sqlalchemy-import-context-issue
 """
 
+PARSED_CALENDARS = LRUCache(maxsize=512)
+"""
+`EventIndex`es keyed by the content hash of the `calendar_data` they were
+parsed from. See `User.event_index`.
+"""
+
+ENCODED_CALENDARS = LRUCache(maxsize=512)
+"""
+`intervals.Busy` encodings of calendars, keyed like `PARSED_CALENDARS`
+"""
+
+WEEK_BITMAPS = LRUCache(maxsize=512)
+"""
+Dictionaries of the start of a week to the `bitsets` encoding of that week of
+a calendar, keyed like `PARSED_CALENDARS`
+"""
+
 ########################
 ### BUSINESS OBJECTS ###
 ########################
 
+def intern_text(text: Optional[str]) -> Optional[str]:
+    """
+    Interns a string, so that equal strings share one object. `icalendar`'s
+    `vText`s are turned into plain `str`s, as only they can be interned.
+    """
+    return None if text is None else sys.intern(str(text))
+
+
 class Period(object):
     """
     An abstract class representing the concept of a period of time
+
+    NOTE: Periods, and their subclasses, use `__slots__`, as a semester's
+        calendar is hundreds of them, and we cache one per user
     """
+    __slots__ = ('start', 'end')
     
     def __init__(self, start: datetime, end: datetime) -> None:
         self.start = start
@@ -48,6 +105,14 @@ class Period(object):
     def __contains__(self, instant: datetime) -> bool:
         return self.start <= instant <= self.end
 
+    @property
+    def start_epoch(self) -> int:
+        return int(self.start.timestamp())
+
+    @property
+    def end_epoch(self) -> int:
+        return int(self.end.timestamp())
+
 
 class Break(Period):
     """
@@ -56,6 +121,7 @@ class Break(Period):
     NOTE: This adds some presentation logic onto Period, which it extends, mostly
         unchanged
     """
+    __slots__ = ()
 
     @property
     def is_short(self) -> bool:
@@ -86,12 +152,16 @@ class Event_(Period):
 
     NOTE: The name `Event_` was chosen so that it did not shadow the `icalendar`
         class `Event`
+
+    NOTE: `summary` and `location` are interned, as the same few subjects and
+        rooms repeat all semester
     """
+    __slots__ = ('summary', 'location')
 
     def __init__(self, summary: str, location: str, start: datetime, end: datetime) -> None:
         super().__init__(start=start, end=end)
-        self.summary = summary
-        self.location = location
+        self.summary = intern_text(summary)
+        self.location = intern_text(location)
 
     def to_dict(self) -> dict:
         start_string = str(self.start.strftime('%H:%M'))
@@ -101,6 +171,143 @@ class Event_(Period):
     def __repr__(self) -> str:
         return f"Event_({repr(self.summary)}, {repr(self.location)}, {repr(self.start)}, {repr(self.end)})"
 
+def get_brisbane_date(instant: datetime) -> date:
+    """
+    The day in Brisbane that `instant` falls on. Floating (naive) times are
+    taken to already be in Brisbane time.
+    """
+    if instant.tzinfo is None:
+        return instant.date()
+    return instant.astimezone(BRISBANE_TIME_ZONE).date()
+
+class EventIndex(object):
+    """
+    A calendar's events sorted by start, and bucketed by the day and the ISO
+    week that they start in, in Brisbane, so that "today", "this week" and "now" don't
+    have to scan the whole semester.
+
+    Build one per parsed calendar (see `User.event_index`), and treat it as
+    immutable, as it's shared between requests.
+    """
+
+    def __init__(self, events: Iterable[Period]) -> None:
+        self.events = sorted(events, key=lambda i: i.start)
+        self.starts = [ i.start for i in self.events ]
+        # Running maximum of the ends, so that we can bisect for the first
+        # event that hasn't ended yet
+        self.ends_so_far = list(accumulate((i.end for i in self.events), max))
+        self.ends = sorted(i.end for i in self.events)
+
+        self.days: Dict[date, Tuple[int, int]] = {}
+        self.weeks: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+        # Events are sorted, so each bucket is a contiguous slice of them
+        for i, event in enumerate(self.events):
+            day = get_brisbane_date(event.start)
+            week = day.isocalendar()[:2]
+            self.days[day] = (self.days.get(day, (i, i))[0], i + 1)
+            self.weeks[week] = (self.weeks.get(week, (i, i))[0], i + 1)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def on_day(self, instant: datetime) -> List[Period]:
+        """
+        The events starting on the same day as `instant`
+        """
+        lo, hi = self.days.get(get_brisbane_date(instant), (0, 0))
+        return self.events[lo:hi]
+
+    def in_week(self, instant: datetime) -> List[Period]:
+        """
+        The events starting in the same (Monday to Sunday) week as `instant`
+        """
+        lo, hi = self.weeks.get(get_brisbane_date(instant).isocalendar()[:2], (0, 0))
+        return self.events[lo:hi]
+
+    def between(self, start: datetime, end: datetime) -> List[Period]:
+        """
+        The events starting within [start, end]
+        """
+        return self.events[bisect_left(self.starts, start):bisect_right(self.starts, end)]
+
+    def overlapping(self, start: datetime, end: datetime) -> List[Period]:
+        """
+        The events that overlap [start, end] at all, including any that started
+        before it
+        """
+        lo = bisect_left(self.ends_so_far, start)
+        hi = bisect_right(self.starts, end)
+        return [ i for i in self.events[lo:hi] if start <= i.end ]
+
+    def current(self, instant: datetime) -> Optional[Period]:
+        """
+        The earliest starting event that `instant` falls in, if any
+        """
+        i = bisect_left(self.ends_so_far, instant)
+        if i < len(self.events) and self.events[i].start <= instant:
+            return self.events[i]
+
+        return None
+
+    def next(self, instant: datetime) -> Optional[Period]:
+        """
+        The first event starting after `instant`, if any
+        """
+        i = bisect_right(self.starts, instant)
+        return self.events[i] if i < len(self.events) else None
+
+    def last_change(self, instant: datetime) -> Optional[datetime]:
+        """
+        The last time, at or before `instant`, that an event started or ended.
+        Anything worked out from which events are on, or over, stays the same
+        until the next one does.
+        """
+        last_start = bisect_right(self.starts, instant)
+        last_end = bisect_right(self.ends, instant)
+        changes = [ self.starts[last_start - 1] ] if last_start else []
+        changes += [ self.ends[last_end - 1] ] if last_end else []
+
+        return max(changes) if changes else None
+
+    def next_change(self, instant: datetime) -> Optional[datetime]:
+        """
+        The first time, after `instant`, that an event starts or ends
+        """
+        next_start = bisect_right(self.starts, instant)
+        next_end = bisect_right(self.ends, instant)
+        changes = [ self.starts[next_start] ] if next_start < len(self.starts) else []
+        changes += [ self.ends[next_end] ] if next_end < len(self.ends) else []
+
+        return min(changes) if changes else None
+
+
+class EvaluationContext(object):
+    """
+    A consistent view of "now" for the lifetime of a request, that memoizes
+    everything derived from each user's calendar as of that instant.
+
+    Endpoints that look at many users, like `/statuses`, should create one of
+    these and pass it down, so that each user's status (and the current user's
+    events) are worked out exactly once.
+    """
+
+    def __init__(self, now: Optional[datetime] = None) -> None:
+        self.now = now if now is not None else datetime.now(BRISBANE_TIME_ZONE)
+        self._memo: Dict[Any, Any] = {}
+
+    def memoize(self, name: str, user: Any, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the value of `compute` for the given user, only calling it the
+        first time that `name` is asked for
+        """
+        key = (name, user)
+
+        if key not in self._memo:
+            self._memo[key] = compute()
+
+        return self._memo[key]
+
 ##############
 ### TABLES ###
 ##############
@@ -111,13 +318,17 @@ class User(db.Model, UserMixin):
     username        = db.Column('username',         db.String(128)) # FIXME: Should be "name"
     fb_user_id      = db.Column('fb_user_id',       db.String(128))
     fb_access_token = db.Column('fb_access_token',  db.String(512))
-    fb_friends      = db.Column('fb_friends',       db.LargeBinary())
     _profile_picture = db.Column('profile_picture',  db.String(512)) # FIXME: Remove
     email           = db.Column('email',            db.String(128))
     registered_on   = db.Column('registered_on',    db.DateTime)
     calendar_url    = db.Column('calendar_url',     db.String(512))
     calendar_data   = db.Column('calendar_data',    db.LargeBinary())
+    calendar_etag   = db.Column('calendar_etag',    db.String(256))
+    calendar_last_modified = db.Column('calendar_last_modified', db.String(64))
     incognito       = db.Column('incognito',        db.Boolean())
+    stored_events   = db.relationship('CalendarEvent', cascade='all, delete-orphan')
+    facebook_friends = db.relationship('FacebookFriend', cascade='all, delete-orphan',
+                                       lazy='dynamic')
     # checked_in_at = db.Column('checkedInAt'), db.datetime()???, nullable=true )
     # on_break_at = db.Column('onBreakAt'), db.datetime()????, nullable=true)
     # TODO: Add these fields
@@ -158,22 +369,124 @@ class User(db.Model, UserMixin):
         elif "t" == url[0]: # User didnt copy across the https://
             url = f"https://{url}"
 
-        response = urllib.request.urlopen(url)
-        data = response.read()
+        with metrics.timed("suq_outbound_request_duration_seconds", target="calendar"):
+            response = urllib.request.urlopen(get_calendar_download_url(url),
+                                              timeout=CALENDAR_DOWNLOAD_TIMEOUT)
+            data = response.read()
+
+        self.update_calendar(url, data, etag=response.headers.get('ETag'),
+                             last_modified=response.headers.get('Last-Modified'))
+        logging.info(f"Calendar added")
+
+    def update_calendar(self, url: str, data: bytes, etag: Optional[str] = None,
+                        last_modified: Optional[str] = None) -> None:
+        """
+        Replaces the user's calendar with `data`, downloaded from `url`.
+        `etag` and `last_modified` are the validators the server sent with it,
+        if any.
 
+        Throws if the calendar is invalid, leaving the user untouched.
+        """
         try:        
-            Calendar.from_ical(data) # XXX: Throws exceptions when data is invalid
-            self.calendar_url = url
-            self.calendar_data = data
-            logging.info(f"Calendar added")
+            events = parse_calendar(data) # XXX: Throws exceptions when data is invalid
         except Exception as e:
             logging.error(f"An invalid calendar was found when {url} was followed: {e}")
             raise e
 
+        self.invalidate_cached_events()
+        self.calendar_url = url
+        self.calendar_data = data
+        self.calendar_etag = etag
+        self.calendar_last_modified = last_modified
+        self.store_events(events)
+        # We've already paid for the parse, so prime the cache with it
+        PARSED_CALENDARS.put(content_hash(data), EventIndex(events))
+
     def remove_calendar(self) -> None:
+        self.invalidate_cached_events()
         self.calendar_url = ""
         self.calendar_data = None
+        self.calendar_etag = None
+        self.calendar_last_modified = None
+        self.stored_events = []
+
+    def store_events(self, events: List[Event_]) -> None:
+        """
+        Replaces the user's rows in the `Events` table with `events`
+        """
+        self.stored_events = [ CalendarEvent.from_event(i) for i in events ]
+
+    @property
+    def has_stored_events(self) -> bool:
+        """
+        Whether the user's calendar has been exploded into the `Events` table.
+        Users that added their calendar before the table existed need to be
+        backfilled with `flask backfill-events`.
+        """
+        if self.id is None:
+            return False
+
+        return db.session.query(
+            CalendarEvent.query.filter_by(user_id=self.id).exists()).scalar()
+
+    def invalidate_cached_events(self) -> None:
+        """
+        Evicts this user's parsed calendar from `PARSED_CALENDARS`
+        """
+        if self.calendar_data is not None:
+            key = self.calendar_version
+            PARSED_CALENDARS.invalidate(key)
+            ENCODED_CALENDARS.invalidate(key)
+            WEEK_BITMAPS.invalidate(key)
+
+    @property
+    def calendar_version(self) -> Optional[str]:
+        """
+        The content hash of `calendar_data`, which keys the caches of everything
+        derived from it. Remembered until `calendar_data` is replaced, as
+        hashing it on every access adds up over a friend list.
+        """
+        data = self.calendar_data
+        if data is None:
+            return None
+
+        hashed = getattr(self, '_calendar_version', None)
+        if hashed is None or hashed[0] is not data:
+            hashed = self._calendar_version = (data, content_hash(data))
+
+        return hashed[1]
     
+    @property
+    def fb_friend_ids(self) -> Set[str]:
+        """
+        The Facebook ids of the user's Facebook friends, as of their last sync
+        """
+        return { i for (i, ) in db.session.query(FacebookFriend.fb_friend_id)
+                                          .filter(FacebookFriend.user_id == self.id) }
+
+    def sync_fb_friends(self, fb_friend_ids: Iterable[str]) -> None:
+        """
+        Makes the user's Facebook friends exactly `fb_friend_ids`, only
+        inserting and deleting the friendships that have changed
+        """
+        new_ids = set(fb_friend_ids)
+        new_ids.discard(self.fb_user_id)
+        old_ids = self.fb_friend_ids
+
+        removed = old_ids - new_ids
+        added = new_ids - old_ids
+
+        if removed:
+            FacebookFriend.query.filter(FacebookFriend.user_id == self.id,
+                                        FacebookFriend.fb_friend_id.in_(removed))\
+                                .delete(synchronize_session=False)
+
+        for fb_friend_id in added:
+            self.facebook_friends.append(FacebookFriend(fb_friend_id))
+
+        logging.info(f"Synced {self.username}'s Facebook friends: "
+                     f"{len(added)} added, {len(removed)} removed")
+
     @property
     def profile_picture(self) -> str:
         if self.fb_user_id is not None:
@@ -187,13 +500,63 @@ class User(db.Model, UserMixin):
         return get_breaks(self.events)
 
     @property
-    def calendar(self) -> Calendar:
+    def calendar(self) -> 'Calendar':
+        from icalendar import Calendar # type: ignore
+
         logging.debug(f"Type of calendar_data is {type(self.calendar_data)}")
-        return Calendar.from_ical(self.calendar_data)
+        with metrics.timed("suq_ics_parse_duration_seconds", parser="strict"):
+            return Calendar.from_ical(self.calendar_data)
 
     @property
     def events(self) -> List[Event_]:
-        return get_events(self.calendar)
+        return list(self.event_index.events)
+
+    @property
+    def event_index(self) -> EventIndex:
+        """
+        The user's events, indexed. Loaded from the `Events` table if they've
+        been stored there, and parsed out of `calendar_data` otherwise.
+        """
+        def load() -> List[Event_]:
+            if self.has_stored_events:
+                return [ i.to_event() for i in CalendarEvent.query
+                    .filter_by(user_id=self.id).order_by(CalendarEvent.start) ]
+
+            return parse_calendar(self.calendar_data)
+
+        if self.calendar_data is None:
+            return EventIndex([])
+
+        return PARSED_CALENDARS.get_or_compute(self.calendar_version,
+                                               lambda: EventIndex(load()))
+
+    def get_event_index(self, context: EvaluationContext) -> EventIndex:
+        """
+        `self.event_index`, fetched at most once per context
+        """
+        return context.memoize("event_index", self, lambda: self.event_index)
+
+    @property
+    def busy(self) -> intervals.Busy:
+        """
+        The user's events, encoded for the NumPy breaks engine
+        """
+        return ENCODED_CALENDARS.get_or_compute(self.calendar_version,
+            lambda: intervals.encode(self.events))
+
+    def get_week_bitmap(self, week_start: datetime) -> int:
+        """
+        The user's busy slots in the week starting at `week_start`, encoded for
+        the bitset breaks engine
+        """
+        weeks = WEEK_BITMAPS.get_or_compute(self.calendar_version, dict)
+
+        if week_start not in weeks:
+            week_end = week_start + timedelta(days=7)
+            weeks[week_start] = bitsets.encode_week(
+                self.event_index.overlapping(week_start, week_end), week_start)
+
+        return weeks[week_start]
 
     @property
     def subjects(self) -> Set[str]:
@@ -202,29 +565,53 @@ class User(db.Model, UserMixin):
     @property
     def timetable(self) -> Dict[str, List[dict]]:
         now = datetime.now(BRISBANE_TIME_ZONE)
-        user_events = get_this_weeks_events(now, self.events)
+        user_events = self.event_index.in_week(now)
         events_dict = weeks_events_to_dictionary(user_events)
         return events_dict
 
+    def get_todays_events(self, context: EvaluationContext) -> List[Event_]:
+        return context.memoize("todays_events", self,
+            lambda: self.get_event_index(context).on_day(context.now))
+
+    def get_todays_breaks(self, context: EvaluationContext) -> List[Break]:
+        # Breaks that aren't overnight can only sit between two of today's events
+        return context.memoize("todays_breaks", self,
+            lambda: get_breaks(self.get_todays_events(context)))
+
     @property
     def current_event(self) -> Optional[Event_]:
-        now = datetime.now(BRISBANE_TIME_ZONE)
+        return self.get_current_event(EvaluationContext())
 
-        for event in self.events:
-            if now in event:
-                return event
-        
-        return None
+    def get_current_event(self, context: EvaluationContext) -> Optional[Event_]:
+        return self.get_event_index(context).current(context.now)
 
     @property
     def current_break(self) -> Optional[Break]:
-        now = datetime.now(BRISBANE_TIME_ZONE)
+        return self.get_current_break(EvaluationContext())
 
-        for brk in self.breaks:
-            if now in brk:
-                return brk
-        
-        return None
+    def get_current_break(self, context: EvaluationContext) -> Optional[Break]:
+        index = context.memoize("todays_break_index", self,
+            lambda: EventIndex(self.get_todays_breaks(context)))
+        return index.current(context.now)
+
+    def get_remaining_busy_blocks(self, context: EvaluationContext) -> List[Block]:
+        """
+        The user's `Block`s of busy time that could bound one of this week's
+        remaining breaks, worked out at most once per context
+        """
+        def compute() -> List[Block]:
+            window = get_remaining_week_window(context.now)
+            events = self.get_event_index(context).overlapping(window.start, window.end)
+            return get_busy_blocks((i.start, i.end) for i in events)
+
+        return context.memoize("remaining_busy_blocks", self, compute)
+
+    def get_events(self, context: EvaluationContext) -> List[Event_]:
+        """
+        `self.events`, fetched at most once per context
+        """
+        return context.memoize("events", self,
+            lambda: list(self.get_event_index(context).events))
         
     @property
     def whats_due(self) -> List[Dict[str, str]]:
@@ -232,12 +619,18 @@ class User(db.Model, UserMixin):
 
     @property
     def status(self) -> Dict[str, str]: 
+        return self.get_status(EvaluationContext())
+
+    def get_status(self, context: EvaluationContext) -> Dict[str, str]:
         """
         Finds out the users current status
         One of 7 possible status's
         Unknown, Unavailable, Finished, Starting, Busy, Free, Unknown
         """
-        user_details = { "name" : self.username, "dp": self.profile_picture }
+        return context.memoize("status", self, lambda: self._compute_status(context))
+
+    def _compute_status(self, context: EvaluationContext) -> Dict[str, str]:
+        user_details = { "name" : self.username, "fbId": self.fb_user_id, "dp": self.profile_picture }
 
         def make_user_status(status: str, status_info: str) -> Dict[str, str]: 
             return { "status": status, "statusInfo": status_info }
@@ -249,8 +642,8 @@ class User(db.Model, UserMixin):
         if self.calendar_data is None:
             return { **user_details, **make_user_status("Unknown", "User has no calendar") }
 
-        now = datetime.now(BRISBANE_TIME_ZONE)
-        user_events = get_todays_events(now, self.events)
+        now = context.now
+        user_events = self.get_todays_events(context)
 
         # Case 2: User does not have uni today
         if user_events == [] or self.incognito: 
@@ -268,8 +661,8 @@ class User(db.Model, UserMixin):
                 user_events, key=lambda i: i.start)[0].start.strftime('%H:%M')
             return { **user_details, **make_user_status("Starting", f"Uni starts at {start_time}")}
 
-        busy_event = self.current_event
-        break_event = self.current_break
+        busy_event = self.get_current_event(context)
+        break_event = self.get_current_break(context)
 
         # Case 5: User is on a break at uni
         if break_event is not None and not break_event.is_short:
@@ -282,8 +675,7 @@ class User(db.Model, UserMixin):
             #                       AND DOES NOT RETURN
             # We're free to perform the index on [0] here because short breaks
             # only get created when there's events ahead of us
-            busy_event = sorted([ i for i in user_events
-                if now < i.start ], key=lambda i: i.start)[0]
+            busy_event = self.get_event_index(context).next(now)
 
         # Case 7: User is busy at uni
         if busy_event is not None:
@@ -298,30 +690,39 @@ class User(db.Model, UserMixin):
         # Case 8: Something went wrong
         return { **user_details, **make_user_status("Unknown", "???")}
         
-    def availability(self, friend) -> Dict[str, Any]:
+    def availability(self, friend, context: Optional[EvaluationContext] = None) -> Dict[str, Any]:
         """
         Returns the user's current status and a list of "sync"'d breaks between
         the user and the friend parameter
         """
+        if context is None:
+            context = EvaluationContext()
+
+        status = self.get_status(context)
+
         if self.calendar_data is not None and friend.calendar_data is not None:
-            breaks = get_remaining_shared_breaks_this_week({self, friend})
-            return { **self.status, "breaks": [ i.to_dict() for i in breaks ] }		
+            breaks = get_remaining_pairwise_breaks(self, friend, context)
+            return { **status, "breaks": [ i.to_dict() for i in breaks ] }		
         
-        return { **self.status, "breaks": [] }
+        return { **status, "breaks": [] }
 
     @property
-    def confirmed_friends(self):
+    def confirmed_friends(self) -> List['User']:
         """
         Finds the current user's confirmed friends.
+
+        That is, the users this user has added, who have added this user back,
+        found in a single query by joining `HasFriend` against itself.
         """
-        confirmed_friends = []
-        for friend in HasFriend.query.filter_by(fb_id=self.fb_user_id).all():
-            logging.info(f"Checking whether fb id {friend.friend_fb_id} is friends with {self.username}")
+        added_back = aliased(HasFriend)
+
+        confirmed_friends = User.query\
+            .join(HasFriend, HasFriend.friend_fb_id == User.fb_user_id)\
+            .join(added_back, and_(added_back.fb_id == HasFriend.friend_fb_id,
+                                   added_back.friend_fb_id == HasFriend.fb_id))\
+            .filter(HasFriend.fb_id == self.fb_user_id).all()
 
-            # Find whether the friend has added the user
-            if HasFriend.query.filter_by(fb_id=friend.friend_fb_id, friend_fb_id=friend.fb_id).first() != None:
-                logging.info(f"{self.username} is a confirmed friend of fb_id {friend.friend_fb_id}")
-                confirmed_friends.append(User.query.filter_by(fb_user_id=friend.friend_fb_id).first())
+        logging.debug(f"{self.username} has {len(confirmed_friends)} confirmed friends")
         return confirmed_friends
 
     def check_in(self) -> None:
@@ -386,11 +787,180 @@ class HasFriend(db.Model):
         logging.info("Friendship created")
 
 
+class FacebookFriend(db.Model):
+    """
+    A uni-directional Facebook friendship, as reported by Facebook when the
+    user last synced their friend list.
+
+    The friend need not be registered with us.
+    """
+    __tablename__ = "FacebookFriends"
+    user_id      = db.Column('user_id',       db.Integer,
+                             db.ForeignKey('Users.id', ondelete='CASCADE'), primary_key=True)
+    fb_friend_id = db.Column('fb_friend_id',  db.String(128),
+                             primary_key=True, index=True)
+
+    def __init__(self, fb_friend_id: str) -> None:
+        self.fb_friend_id = fb_friend_id
+
+
+class CalendarEvent(db.Model):
+    """
+    A single event from a user's calendar.
+
+    These are exploded out of `User.calendar_data` at `add_calendar` time so
+    that `User.event_index` can be loaded without parsing the calendar, when
+    it isn't in `PARSED_CALENDARS`. They're only ever read all at once, in
+    order, which is what `ix_Events_user_id_start` is for.
+
+    NOTE: `start` and `end` are stored as naive UTC, as SQLite throws away
+        timezones
+    """
+    __tablename__ = "Events"
+    __table_args__ = (db.Index('ix_Events_user_id_start', 'user_id', 'start'), )
+    id       = db.Column('id',         db.Integer,     primary_key=True)
+    user_id  = db.Column('user_id',    db.Integer,
+                         db.ForeignKey('Users.id', ondelete='CASCADE'), nullable=False)
+    summary  = db.Column('summary',    db.String(256))
+    location = db.Column('location',   db.String(256))
+    start    = db.Column('start',      db.DateTime,    nullable=False)
+    end      = db.Column('end',        db.DateTime,    nullable=False)
+
+    @staticmethod
+    def from_event(event: Event_) -> 'CalendarEvent':
+        row = CalendarEvent()
+        row.summary = event.summary
+        row.location = event.location
+        row.start = to_utc_naive(event.start)
+        row.end = to_utc_naive(event.end)
+        return row
+
+    def to_event(self) -> Event_:
+        return Event_(self.summary, self.location,
+                      from_utc_naive(self.start), from_utc_naive(self.end))
+
+
+class CalendarImport(db.Model):
+    """
+    A request to download and import a user's calendar, which happens on the
+    `JobQueue` rather than on the request path, as Timetable Planner can be
+    slow.
+
+    `status` moves from `PENDING` to `RUNNING`, at `started`, then to either
+    `DONE` or `FAILED`, in which case `error` says why.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    __tablename__ = "CalendarImports"
+    id       = db.Column('id',         db.String(32),  primary_key=True)
+    user_id  = db.Column('user_id',    db.Integer,
+                         db.ForeignKey('Users.id', ondelete='CASCADE'), nullable=False, index=True)
+    url      = db.Column('url',        db.String(512))
+    status   = db.Column('status',     db.String(16),  nullable=False)
+    error    = db.Column('error',      db.String(256))
+    created  = db.Column('created',    db.DateTime)
+    started  = db.Column('started',    db.DateTime)
+    finished = db.Column('finished',   db.DateTime)
+
+    def __init__(self, user_id: int, url: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.url = url
+        self.status = CalendarImport.PENDING
+        self.created = datetime.utcnow()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (CalendarImport.DONE, CalendarImport.FAILED)
+
+    def fail_if_abandoned(self) -> None:
+        """
+        Marks the job as failed if it's been running for longer than
+        `CALENDAR_IMPORT_TIMEOUT`. Jobs run in the worker that took the
+        request, so they're lost if it's killed or recycled part way through.
+        Pending jobs are left alone, as they may just be queued behind others.
+        """
+        now = datetime.utcnow()
+        if self.status == CalendarImport.RUNNING and \
+                now - self.started > timedelta(seconds=CALENDAR_IMPORT_TIMEOUT):
+            self.status = CalendarImport.FAILED
+            self.error = "Timed out importing the calendar"
+            self.finished = now
+
+    def to_dict(self) -> Dict[str, Optional[str]]:
+        return { "id": self.id, "status": self.status, "error": self.error }
+
+
 ######################
 ### BUSINESS LOGIC ###
 ######################
 
-def get_events(cal: Calendar) -> List[Event_]:
+def start_calendar_import(user: User, url: str) -> CalendarImport:
+    """
+    Records a pending import of the calendar at `url` for `user`, forgetting
+    about their previous, finished imports. The caller is responsible for
+    committing, then running `run_calendar_import` on the job's id.
+    """
+    CalendarImport.query.filter(CalendarImport.user_id == user.id,
+                                CalendarImport.status.in_([ CalendarImport.DONE,
+                                                            CalendarImport.FAILED ]))\
+                        .delete(synchronize_session=False)
+
+    job = CalendarImport(user.id, url)
+    db.session.add(job)
+    return job
+
+
+def run_calendar_import(job_id: str) -> None:
+    """
+    Downloads and imports the calendar of a `CalendarImport`, recording how it
+    went. Meant to be run on the `JobQueue`, inside an app context.
+    """
+    job = CalendarImport.query.get(job_id)
+    if job.is_finished:
+        # Given up on while it was waiting, so the client has been told
+        return
+
+    job.status = CalendarImport.RUNNING
+    job.started = datetime.utcnow()
+    db.session.commit()
+
+    try:
+        User.query.get(job.user_id).add_calendar(job.url)
+        job.status = CalendarImport.DONE
+    except Exception as e:
+        db.session.rollback()
+        logging.warning(f"Could not import the calendar at {job.url}: {e}")
+
+        job.status = CalendarImport.FAILED
+        if isinstance(e, OSError): # Includes `URLError`s and timeouts
+            job.error = "Could not download the calendar"
+        else:
+            job.error = "Invalid Calendar"
+
+    job.finished = datetime.utcnow()
+    db.session.commit()
+    logging.info(f"Calendar import {job.id} {job.status}")
+
+
+def to_utc_naive(instant: datetime) -> datetime:
+    """
+    Converts a timezone aware datetime into the naive UTC form we store in the DB
+    """
+    return instant.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def from_utc_naive(instant: datetime) -> datetime:
+    """
+    Inverse of `to_utc_naive`, landing in Brisbane's timezone
+    """
+    return instant.replace(tzinfo=timezone.utc).astimezone(BRISBANE_TIME_ZONE)
+
+
+def get_events(cal: 'Calendar') -> List[Event_]:
     """
     Given a calendar, extracts all porcelain `Event_`s and throws away all
     other information
@@ -405,6 +975,29 @@ def get_events(cal: Calendar) -> List[Event_]:
     # makes assumptions about the order of the calendar
     return sorted(events, key=lambda i: i.start)
 
+def get_ics_parser() -> str:
+    """
+    How `parse_calendar` should read calendars, as set by the `ICS_PARSER`
+    config key. One of "fast", for `backend.ics`, or "strict", for `icalendar`.
+    """
+    return current_app.config.get('ICS_PARSER', "fast") if has_app_context() else "fast"
+
+
+def parse_calendar(data: bytes) -> List[Event_]:
+    """
+    Parses a calendar blob straight into sorted `Event_`s. Throws if the
+    calendar is invalid.
+    """
+    parser = get_ics_parser()
+
+    with metrics.timed("suq_ics_parse_duration_seconds", parser=parser):
+        if parser == "strict":
+            from icalendar import Calendar # type: ignore
+            return get_events(Calendar.from_ical(data))
+
+        events = [ Event_(*i) for i in ics.parse_events(data) ]
+        return sorted(events, key=lambda i: i.start)
+
 
 def get_datetime_of_week_start(original: datetime) -> datetime:
     """
@@ -422,25 +1015,61 @@ def get_breaks(events: List[Event_]) -> List[Break]:
     Given a list of events, returns a list of breaks between these events that:
         1) Aren't overnight
         2) Aren't "short"
-    """
 
-    by_start = deque(sorted(events, key=lambda i: i.start))
+    This sweeps over the events in order of start time, keeping track of the
+    end of the block of (possibly overlapping) events we're currently in. Any
+    event that starts after that block ends opens a gap, so we're O(n log n)
+    in the number of events, which matters for merged group calendars.
+    """
+    by_start = sorted(events, key=lambda i: i.start)
 
     breaks: List[Break] = []
 
-    while True:
-        # If we've run out of gaps between two events to find
-        if len(by_start) < 2:
-            return [i for i in breaks if not i.is_short and not i.is_overnight]
+    if by_start == []:
+        return breaks
 
-        subject = by_start.popleft()
+    busy_until = by_start[0].end
 
-        if any(subject.end in i for i in by_start):
-            continue
+    for event in by_start[1:]:
+        if busy_until < event.start:
+            breaks.append(Break(busy_until, event.start))
+
+        busy_until = max(busy_until, event.end)
+
+    return [i for i in breaks if not i.is_short and not i.is_overnight]
+
+def get_busy_blocks(periods: Iterable[Block]) -> List[Block]:
+    """
+    Merges (start, end) pairs, sorted by start, into disjoint blocks of busy
+    time. Like `get_breaks`, events that touch are merged.
+    """
+    blocks: List[Block] = []
+
+    for start, end in periods:
+        if blocks != [] and start <= blocks[-1][1]:
+            if blocks[-1][1] < end:
+                blocks[-1] = (blocks[-1][0], end)
         else:
-            # Only subjects with "exposed" outer-ends
-            # get to create a break to the next event
-            breaks.append(Break(subject.end, by_start[0].start))
+            blocks.append((start, end))
+
+    return blocks
+
+def get_pairwise_breaks(mine: List[Block], theirs: List[Block],
+                        now: datetime) -> List[Break]:
+    """
+    Given two people's busy `Block`s for the remaining week, from
+    `get_remaining_week_window`, returns the same breaks as
+    `get_remaining_shared_breaks_this_week` would for the pair.
+
+    That is, the time that both are free, between their blocks, in a single
+    linear merge of the two.
+    """
+    week = get_week_period(now)
+    blocks = get_busy_blocks(heapq.merge(mine, theirs))
+
+    breaks = [ Break(before[1], after[0]) for before, after in zip(blocks, blocks[1:]) ]
+    return [ i for i in breaks if not i.is_short and not i.is_overnight
+                                  and now < i.end and i.start in week ]
 
 def weeks_events_to_dictionary(events: List[Event_]) -> Dict[str, List[dict]]:
     """
@@ -459,46 +1088,137 @@ def weeks_events_to_dictionary(events: List[Event_]) -> Dict[str, List[dict]]:
     return week_events
 
 
-def get_this_weeks_events(instant: datetime, events: List[Event_]) -> List[Event_]:
+def get_week_period(instant: datetime) -> Period:
     """
-    Given a date, and a list of events, returns the list of events from 
-    the week (Sunday -> Sunday).
+    Given a date, returns the week (Sunday -> Sunday) that it falls in
     """
     week_start = get_datetime_of_week_start(instant)
     week_end = week_start + timedelta(days=7)
-    return [ i for i in events if i.start in Period(week_start, week_end) ]
+    return Period(week_start, week_end)
 
-def get_todays_events(instant: datetime, events: List[Event_]) -> List[Event_]:
+def get_day_period(instant: datetime) -> Period:
     """
-    TODO
+    Given a date, returns the day that it falls in
     """
     day_start = instant.replace(hour=0, minute=0)
     day_end = day_start + timedelta(hours=23, minutes=59)
-    return [ i for i in events if i.start in Period(day_start, day_end) ]
+    return Period(day_start, day_end)
+
+def get_remaining_week_window(instant: datetime) -> Period:
+    """
+    Given a date, returns the period holding every event that could bound one
+    of the remaining breaks in its week.
+
+    Breaks never span midnight, so a break that hasn't finished yet must have
+    started today, and one that starts this week ends by the day after.
+    """
+    week = get_week_period(instant)
+    today = instant.replace(hour=0, minute=0, second=0, microsecond=0)
+    return Period(max(week.start, today), week.end + timedelta(days=1))
+
+def get_this_weeks_events(instant: datetime, events: List[Event_]) -> List[Event_]:
+    """
+    Given a date, and a list of events, returns the list of events from 
+    the week (Sunday -> Sunday).
+    """
+    week = get_week_period(instant)
+    return [ i for i in events if i.start in week ]
+
+def get_todays_events(instant: datetime, events: List[Event_]) -> List[Event_]:
+    """
+    Given a date, and a list of events, returns the list of events from that day
+    """
+    day = get_day_period(instant)
+    return [ i for i in events if i.start in day ]
 
-def cull_past_breaks(events: List[Break]) -> List[Break]:
+def cull_past_breaks(events: List[Break], now: Optional[datetime] = None) -> List[Break]:
     """
     Removes breaks before the current time
     """
      # Here be dragons: This is hardcoded to Brisbane's timezone
-    now = datetime.now(BRISBANE_TIME_ZONE)
+    if now is None:
+        now = datetime.now(BRISBANE_TIME_ZONE)
 
     return sorted([i for i in events if now < i.end], key=lambda i: i.start)
 
 
-def get_shared_breaks(group_members: Set[User]) -> List[Break]:
+def get_breaks_engine() -> str:
+    """
+    Which implementation `get_shared_breaks` should use, as set by the
+    `BREAKS_ENGINE` config key. One of "python", "numpy", where the latter
+    falls back to the former if NumPy isn't installed, or "bitset", which only
+    applies to `get_remaining_shared_breaks_this_week`.
+    """
+    engine = current_app.config.get('BREAKS_ENGINE', "python") \
+        if has_app_context() else "python"
+
+    if engine == "numpy" and not intervals.NUMPY_AVAILABLE:
+        logging.warning("BREAKS_ENGINE is 'numpy', but NumPy isn't installed")
+        return "python"
+
+    return engine
+
+
+def get_shared_breaks_vectorized(group_members: Set[User]) -> List[Break]:
+    """
+    The NumPy backed equivalent of `get_breaks` over the members' merged events
+    """
+    gaps = intervals.get_gaps([ user.busy for user in group_members ])
+    breaks = [ Break(datetime.fromtimestamp(start, BRISBANE_TIME_ZONE),
+                     datetime.fromtimestamp(end, BRISBANE_TIME_ZONE))
+               for start, end in gaps ]
+
+    return [i for i in breaks if not i.is_short and not i.is_overnight]
+
+
+def get_shared_breaks(group_members: Set[User],
+                      context: Optional[EvaluationContext] = None) -> List[Break]:
     """
     Finds common breaks between a group of users.
     """
     def concat(xs: Iterable[Iterable[Any]]) -> Iterable[Any]:
         return list(chain.from_iterable(xs))
 
+    if context is None:
+        context = EvaluationContext()
+
+    if get_breaks_engine() == "numpy":
+        return cull_past_breaks(get_shared_breaks_vectorized(group_members), context.now)
+
     merged_calendars = cast(List[Event_], concat(
-        user.events for user in group_members))
-    return cull_past_breaks(get_breaks(merged_calendars))
+        user.get_events(context) for user in group_members))
+    return cull_past_breaks(get_breaks(merged_calendars), context.now)
+
+
+def get_shared_breaks_this_week_bitset(group_members: Set[User],
+                                      context: EvaluationContext) -> List[Break]:
+    """
+    The bitset backed equivalent of `get_remaining_shared_breaks_this_week`
+    """
+    week_start = bitsets.get_week_start(context.now)
+    gaps = bitsets.get_gaps([ user.get_week_bitmap(week_start) for user in group_members ],
+                            week_start)
+    breaks = [ Break(start, end) for start, end in gaps ]
+
+    return [ i for i in breaks if not i.is_short and not i.is_overnight and context.now < i.end ]
+
+
+def get_remaining_pairwise_breaks(user: User, friend: User,
+                                  context: Optional[EvaluationContext] = None) -> List[Break]:
+    """
+    `get_remaining_shared_breaks_this_week` for just the two users. Each user's
+    busy time is worked out once per context, so when `friend` is the same
+    across a friend list, each extra friend only costs a merge of two weeks.
+    """
+    if context is None:
+        context = EvaluationContext()
+
+    return get_pairwise_breaks(friend.get_remaining_busy_blocks(context),
+                               user.get_remaining_busy_blocks(context), context.now)
 
 
-def get_remaining_shared_breaks_this_week(group_members: Set[User]) -> List[Break]:
+def get_remaining_shared_breaks_this_week(group_members: Set[User],
+        context: Optional[EvaluationContext] = None) -> List[Break]:
     """
     Finds this weeks remaining common breaks between a group of users
     """
@@ -509,11 +1229,43 @@ def get_remaining_shared_breaks_this_week(group_members: Set[User]) -> List[Brea
 
     # FIXME: Get rid of these casts when Van Rossum figures out how to write a
     #        proper type system
-    breaks = cast(List[Event_], get_shared_breaks(group_members))
-    now = datetime.now(BRISBANE_TIME_ZONE)
+    if context is None:
+        context = EvaluationContext()
+
+    if get_breaks_engine() == "bitset":
+        return get_shared_breaks_this_week_bitset(group_members, context)
+
+    breaks = cast(List[Event_], get_shared_breaks(group_members, context))
 
     ### ... and out.
-    return cast(List[Break], get_this_weeks_events(now, breaks))
+    return cast(List[Break], get_this_weeks_events(context.now, breaks))
+
+
+def get_statuses_version(user: User, friends: List[User], context: EvaluationContext) -> tuple:
+    """
+    A version key for `/statuses`. The statuses, and the shared breaks, of a
+    user and their friends only change on a new day, when one of their events
+    starts or ends, or when one of them changes their calendar or settings.
+    """
+    def version(member: User) -> tuple:
+        return (member.id, member.username, member.fb_user_id, member.incognito,
+                member.calendar_version,
+                member.get_event_index(context).last_change(context.now))
+
+    return (context.now.date(), version(user),
+            [ version(i) for i in sorted(friends, key=lambda i: i.id) ])
+
+
+def get_next_status_change(users: List[User], context: EvaluationContext) -> datetime:
+    """
+    The first time, after `context.now`, that any of the users' statuses could
+    change: when one of their events starts or ends, or at midnight
+    """
+    midnight = (context.now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    changes = [ i.get_event_index(context).next_change(context.now)
+                for i in users if i.calendar_data is not None ]
+
+    return min([ midnight ] + [ i for i in changes if i is not None ])
 
 
 # FIXME: Make 'request_status' an enum: https://docs.python.org/3/library/enum.html
@@ -526,18 +1278,43 @@ def get_request_status(user_id: str, friend_id: str) -> str:
     "Accept" - the friend has sent a user a friend request, the user has not accepted
     "Friends" - the user and friend are friends.
     """
-    if HasFriend.query.filter_by(fb_id=user_id, friend_fb_id=friend_id).first() != None:
+    added = HasFriend.query.filter_by(fb_id=user_id, friend_fb_id=friend_id).first() != None
+    added_by = HasFriend.query.filter_by(fb_id=friend_id, friend_fb_id=user_id).first() != None
+    result = make_request_status(added, added_by)
+
+    logging.info(f"user {user_id} has the status: '{result}' with user {friend_id}")
+    return result
+
+
+def get_request_statuses(user_id: str) -> Dict[str, str]:
+    """
+    Like `get_request_status`, but for every user that the given user has a
+    relationship with, in two queries. Users missing from the result are
+    "Not Added".
+    """
+    added = { i for (i, ) in db.session.query(HasFriend.friend_fb_id)
+                                       .filter(HasFriend.fb_id == user_id) }
+    added_by = { i for (i, ) in db.session.query(HasFriend.fb_id)
+                                          .filter(HasFriend.friend_fb_id == user_id) }
+
+    return { friend_id: make_request_status(friend_id in added, friend_id in added_by)
+             for friend_id in added | added_by }
+
+
+def make_request_status(added: bool, added_by: bool) -> str:
+    """
+    Given whether the user has added the friend, and whether the friend has
+    added the user, returns their request status
+    """
+    if added:
         # I realise this could be a ternary but trust me this is neater.
-        if HasFriend.query.filter_by(fb_id=friend_id, friend_fb_id=user_id).first() != None:
-            result = "Friends"
+        if added_by:
+            return "Friends"
         else:
-            result = "Pending"
+            return "Pending"
     else:
-        if HasFriend.query.filter_by(fb_id=friend_id, friend_fb_id=user_id).first() != None:
-            result = "Accept"
+        if added_by:
+            return "Accept"
         else:
-            result = "Not Added"
-
-    logging.info(f"user {user_id} has the status: '{result}' with user {friend_id}")
-    return result
+            return "Not Added"
 
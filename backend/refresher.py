@@ -0,0 +1,180 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Keeps stored calendars in sync with UQ Timetable Planner, off the request path.
+
+Calendars are only downloaded when a user posts their URL, so changes to their
+timetable would otherwise never be picked up. Run `flask refresh-calendars`
+to re-fetch them all.
+"""
+
+# Builtins
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Dict, Optional, Set
+
+# Imports
+from backend import metrics
+from backend.middleware import get_calendar_download_url
+from backend.models import db, User
+
+
+class Fetched(object):
+    """
+    The outcome of conditionally re-fetching one user's calendar from `url`
+    """
+
+    def __init__(self, user_id: int, url: str, status: int, data: Optional[bytes] = None,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 error: Optional[str] = None) -> None:
+        self.user_id = user_id
+        self.url = url
+        self.status = status
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.error = error
+
+
+class RefreshStats(object):
+    """
+    Counters for a single run of the `CalendarRefresher`. `fetched` counts full
+    downloads, of which `updated` were actually different, while `unchanged`
+    counts `304 Not Modified`s.
+    """
+
+    def __init__(self) -> None:
+        self.fetched = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return { "fetched": self.fetched, "updated": self.updated,
+                 "unchanged": self.unchanged, "failed": self.failed,
+                 "bytes": self.bytes, "seconds": round(self.seconds, 3) }
+
+
+class CalendarRefresher(object):
+    """
+    Re-downloads every stored calendar, using the `ETag` and `Last-Modified`
+    validators from the last download so that unchanged calendars cost a
+    `304 Not Modified`, and no parsing.
+
+    Downloads run `concurrency` at a time, each after a random delay of up to
+    `jitter` seconds so that we don't hammer Timetable Planner. Everything that
+    touches the database happens on the calling thread, inside its app context.
+
+    Each download is applied as soon as it arrives, and only a couple per
+    thread are started ahead of that, so that we never hold more than a few
+    calendars in memory, however many users there are.
+    """
+
+    def __init__(self, concurrency: int = 4, jitter: float = 0.0,
+                 timeout: float = 10.0) -> None:
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.timeout = timeout
+
+        # Slow to import, and only needed by the refresher, not the web workers
+        import requests
+        self.session = requests.Session()
+
+    def fetch(self, user_id: int, url: str, etag: Optional[str],
+              last_modified: Optional[str]) -> Fetched:
+        if self.jitter > 0:
+            time.sleep(random.uniform(0, self.jitter))
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        import requests
+
+        try:
+            with metrics.timed("suq_outbound_request_duration_seconds", target="calendar"):
+                response = self.session.get(get_calendar_download_url(url),
+                                            headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return Fetched(user_id, url, 0, error=str(e))
+
+        if response.status_code == 304:
+            return Fetched(user_id, url, 304)
+
+        if response.status_code != 200:
+            return Fetched(user_id, url, response.status_code, error=response.reason)
+
+        return Fetched(user_id, url, 200, data=response.content,
+                       etag=response.headers.get('ETag'),
+                       last_modified=response.headers.get('Last-Modified'))
+
+    def refresh_all(self) -> RefreshStats:
+        stats = RefreshStats()
+        started = time.monotonic()
+
+        users = db.session.query(User.id, User.calendar_url, User.calendar_etag,
+                                 User.calendar_last_modified)\
+                          .filter(User.calendar_data != None, User.calendar_url != "").all()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending: Set[Future] = set()
+
+            for user in users:
+                pending.add(pool.submit(self.fetch, *user))
+
+                if len(pending) >= 2 * self.concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.apply(future.result(), stats)
+
+            for future in as_completed(pending):
+                self.apply(future.result(), stats)
+
+        stats.seconds = time.monotonic() - started
+        logging.info(f"Refreshed calendars: {stats.to_dict()}")
+        return stats
+
+    def apply(self, result: Fetched, stats: RefreshStats) -> None:
+        if result.status == 304:
+            stats.unchanged += 1
+            return
+
+        if result.status != 200:
+            stats.failed += 1
+            logging.warning(f"Could not refresh the calendar of user {result.user_id}: "
+                            f"{result.status} {result.error}")
+            return
+
+        stats.fetched += 1
+        stats.bytes += len(result.data)
+        user = User.query.get(result.user_id)
+
+        # They may have deleted their account, or removed or replaced their
+        # calendar, since we listed everyone
+        if user is None or user.calendar_data is None or user.calendar_url != result.url:
+            logging.info(f"Skipped refreshing the calendar of user {result.user_id}, "
+                         f"which changed while it was downloading")
+            return
+
+        if user.calendar_data == result.data:
+            # No validators, or they changed when the calendar didn't
+            user.calendar_etag = result.etag
+            user.calendar_last_modified = result.last_modified
+            db.session.commit()
+            return
+
+        try:
+            user.update_calendar(result.url, result.data, etag=result.etag,
+                                 last_modified=result.last_modified)
+            db.session.commit()
+            stats.updated += 1
+        except Exception:
+            db.session.rollback()
+            stats.failed += 1
+            logging.exception(f"Could not refresh the calendar of user {result.user_id}")
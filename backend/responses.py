@@ -8,11 +8,12 @@ difficulty.
 """
 
 # Builtins
-from typing import Any, Callable
+import hashlib
+from typing import Any, Callable, Iterator, Optional
 from functools import wraps
 
 # Libraries
-from flask import Response, jsonify
+from flask import Response, json, jsonify, request, stream_with_context
 
 class APIException(Exception):
     """
@@ -83,21 +84,56 @@ class NotImplemented(APIException):
         super().__init__(status_code=501, message=message, payload=payload)
 
 
-def _data(status_code: int, data: Any) -> Response:
+def make_etag(*parts: Any) -> str:
+    """
+    Makes a strong ETag for a response that is entirely determined by `parts`,
+    a cheap "version key" that can be worked out before the response itself
+    """
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    """
+    Returns a `304 Not Modified` response if the client already has the
+    version of the response with the given ETag, so that endpoints can skip
+    the work of making it again. Returns `None` otherwise.
+    """
+    if request.method not in ('GET', 'HEAD') or not request.if_none_match.contains(etag):
+        return None
+
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _data(status_code: int, data: Any, etag: Optional[str] = None) -> Response:
     """
     Helper method to create non-error responses adhearing to the Google JSON
     style-guide.
+
+    Successful GETs get a strong ETag, either the given one, from
+    `make_etag`, or a hash of the response, and are answered with a
+    `304 Not Modified` if the client already has them.
     """
     response = jsonify({"data": data} if data else {})
     response.status_code = status_code
+    # Each user gets their own data at the same URL, so only their browser
+    # may cache it, and it has to check with us every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+
+    if status_code == 200 and request.method in ('GET', 'HEAD'):
+        response.set_etag(etag or hashlib.sha1(response.get_data()).hexdigest())
+        response.make_conditional(request)
+
     return response
 
 
-def ok(data: Any = None) -> Response:
+def ok(data: Any = None, etag: Optional[str] = None) -> Response:
     """
     The request has succeeded.
     """
-    return _data(200, data)
+    return _data(200, data, etag)
 
 
 def created(data: Any = None) -> Response:
@@ -107,6 +143,14 @@ def created(data: Any = None) -> Response:
     return _data(201, data)
 
 
+def accepted(data: Any = None) -> Response:
+    """
+    The request has been accepted for processing, but the processing has not
+    been completed.
+    """
+    return _data(202, data)
+
+
 def no_content() -> Response:
     """
     The server has fulfilled the request but does not need to return an
@@ -115,6 +159,28 @@ def no_content() -> Response:
     return _data(204, None)
 
 
+def server_sent_event(data: Any, event: Optional[str] = None) -> str:
+    """
+    Formats `data` as a single server-sent event, wrapped like the rest of
+    our responses
+    """
+    lines = [ f"event: {event}" ] if event is not None else []
+    lines.append(f"data: {json.dumps({'data': data})}")
+    return "\n".join(lines) + "\n\n"
+
+
+def event_stream(events: Iterator[str]) -> Response:
+    """
+    Streams server-sent events to the client as they are yielded, with the
+    request context kept alive for as long as the stream is
+    """
+    response = Response(stream_with_context(events), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stops nginx, and friends, from holding events back in a buffer
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def to_json(func: Callable[..., Response]) -> Response:
     """
     Runs Flask's `jsonify` function against the return value of the annotated
@@ -1,9 +1,49 @@
 __author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
 
+# Builtins
+import http.server
+import io
+import json
+import os
+import random
+import re
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from models import *
-import datetime
+import urllib.error
 import urllib.request
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+from unittest import mock
+
+# Libraries
+import requests
+import sqlalchemy
+from click.testing import CliRunner
+from flask import Flask
+from flask.cli import ScriptInfo
+from icalendar import Calendar # type: ignore
+
+# Before the app is created, so that tests don't touch a real database
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+# Imports
+from backend.models import *
+from backend import ics, metrics, middleware
+from backend.refresher import CalendarRefresher, RefreshStats
+from app import app, jobs, refresh_calendars, stream_statuses
+from bench.breaks import merged_calendars, quadratic_get_breaks
+from bench.generators import make_friend_graph, make_semester_ics
+from bench.loadtest import Results, percentile, summarise
+from bench.standin import StandIn
+
+# `backend.models` exports the `datetime` class, but the tests want the module
+import datetime
+
 
 class TestGetDatetimeOfWeekStart(unittest.TestCase):
     def test_sunday(self) -> None:
@@ -39,7 +79,1129 @@ class TestCalendarParsing(unittest.TestCase):
                 self.fail(msg="Did not throw an exception")
             except:
                 pass
-    
+
+class TestICS(unittest.TestCase):
+    def parse(self, *lines: str) -> List[tuple]:
+        return ics.parse_events("\r\n".join(lines).encode())
+
+    def test_matches_icalendar(self) -> None:
+        for name in ("max", "charlie", "hugo"):
+            with open(f"./calendars/{name}.ics", "rb") as f:
+                data = f.read()
+
+            as_tuples = lambda events: [ (str(i.summary), str(i.location), i.start, i.end)
+                                         for i in events ]
+            self.assertEqual(as_tuples(parse_calendar(data)),
+                             as_tuples(get_events(Calendar.from_ical(data))))
+
+    def test_content_lines(self) -> None:
+        [ (summary, location, start, end) ] = self.parse(
+            "BEGIN:VCALENDAR",
+            "BEGIN:VEVENT",
+            "SUMMARY:CSSE3002 \\\\ T01\\; or",
+            "  not",
+            "LOCATION;LANGUAGE=en:Building 78\\, Room 107",
+            'DTSTART;TZID="Australia/Brisbane":20170301T090000',
+            "DTEND:20170301T005000Z",
+            "BEGIN:VALARM",
+            "SUMMARY:Ignored",
+            "END:VALARM",
+            "END:VEVENT",
+            "END:VCALENDAR")
+
+        self.assertEqual(summary, "CSSE3002 \\ T01; or not")
+        self.assertEqual(location, "Building 78, Room 107")
+        self.assertEqual(start, datetime.datetime(2017, 3, 1, 9, tzinfo=BRISBANE_TIME_ZONE))
+        self.assertEqual(end, datetime.datetime(2017, 3, 1, 10, 50, tzinfo=BRISBANE_TIME_ZONE))
+
+    def test_invalid(self) -> None:
+        with open("./calendars/broken.ics", "rb") as f:
+            self.assertRaises(ics.ICSError, ics.parse_events, f.read())
+
+        invalid = [ (),
+                    ("BEGIN:VCALENDAR", "BEGIN:VEVENT", "END:VCALENDAR"),
+                    ("BEGIN:VCALENDAR", "BEGIN:VEVENT", "DTSTART:20170301T090000", "END:VEVENT",
+                     "END:VCALENDAR"),
+                    ("BEGIN:VCALENDAR", "BEGIN:VEVENT", "DTSTART:2017", "DTEND:20170301T0900",
+                     "END:VEVENT", "END:VCALENDAR") ]
+
+        for lines in invalid:
+            self.assertRaises(ics.ICSError, self.parse, *lines)
+
+    def test_strict(self) -> None:
+        with open("./calendars/max.ics", "rb") as f:
+            data = f.read()
+
+        with app.app_context():
+            app.config['ICS_PARSER'] = "strict"
+            try:
+                with mock.patch.object(ics, "parse_events") as parse_events:
+                    self.assertEqual(len(parse_calendar(data)), 113)
+                parse_events.assert_not_called()
+            finally:
+                app.config['ICS_PARSER'] = "fast"
+
+
+class TestGenerators(unittest.TestCase):
+    def test_semesters_parse(self) -> None:
+        rng = random.Random(22)
+        for _ in range(5):
+            data = make_semester_ics(rng)
+            events = parse_calendar(data)
+
+            self.assertGreater(len(events), 50)
+            self.assertEqual([ (i.summary, i.location, i.start, i.end) for i in events ],
+                             [ (str(i.summary), str(i.location), i.start, i.end)
+                               for i in get_events(Calendar.from_ical(data)) ])
+
+    def test_friend_graph(self) -> None:
+        edges = make_friend_graph(random.Random(22), 100, 8)
+        self.assertEqual(len(edges), 400)
+        self.assertEqual(len(set(edges)), 400)
+        self.assertTrue(all(a < b < 100 for a, b in edges))
+
+
+class TestParsedCalendarCache(unittest.TestCase):
+    def setUp(self) -> None:
+        PARSED_CALENDARS.clear()
+        self.me = User("caching", "email", "fb_user_id", "fb_access_token")
+
+        with open("./calendars/max.ics", "rb") as f:
+            self.me.calendar_data = f.read()
+
+    def test_parses_once(self) -> None:
+        first = self.me.events
+        second = self.me.events
+        self.assertEqual(first, second)
+        self.assertEqual(PARSED_CALENDARS.misses, 1)
+        self.assertEqual(PARSED_CALENDARS.hits, 1)
+
+    def test_returns_sorted_copies(self) -> None:
+        events = self.me.events
+        self.assertEqual(events, sorted(events, key=lambda i: i.start))
+        events.clear()
+        self.assertNotEqual(self.me.events, [])
+
+    def test_remove_calendar_invalidates(self) -> None:
+        self.me.events
+        self.assertEqual(len(PARSED_CALENDARS), 1)
+        self.me.remove_calendar()
+        self.assertEqual(len(PARSED_CALENDARS), 0)
+
+    def test_bounded(self) -> None:
+        cache = LRUCache(maxsize=2)
+        for i in range(3):
+            cache.put(i, i)
+        self.assertNotIn(0, cache)
+        self.assertEqual(cache.get(2), 2)
+        self.assertEqual(cache.stats()["size"], 2)
+
+
+def random_events(rng: random.Random) -> List[Event_]:
+    """
+    Up to a dozen events of random length, landing on 10 minute boundaries
+    over three days
+    """
+    day = datetime.datetime(2017, 3, 27, 8, tzinfo=BRISBANE_TIME_ZONE)
+    events = []
+    for _ in range(rng.randint(0, 12)):
+        start = day + datetime.timedelta(days=rng.randint(0, 2),
+                                         minutes=10 * rng.randint(0, 60))
+        end = start + datetime.timedelta(minutes=10 * rng.randint(1, 18))
+        events.append(Event_("SUBJ1000 L01", "Building 1", start, end))
+    return events
+
+
+class TestGetBreaks(unittest.TestCase):
+    """
+    Checks the sweep-line `get_breaks` against the implementation it replaced,
+    and against a brute force union of the events, over random calendars
+    """
+
+    DAY = datetime.datetime(2017, 3, 27, 8, tzinfo=BRISBANE_TIME_ZONE)
+
+    def brute_force_breaks(self, events: List[Event_]) -> List[Break]:
+        """
+        Walks the span of the events minute by minute, collecting the runs of
+        minutes that no event covers
+        """
+        minute = datetime.timedelta(minutes=1)
+        if events == []:
+            return []
+
+        instant = min(i.start for i in events)
+        last = max(i.end for i in events)
+        breaks = []
+        gap_start = None
+
+        while instant <= last:
+            busy = any(i.start <= instant <= i.end for i in events)
+            if not busy and gap_start is None:
+                gap_start = instant - minute
+            elif busy and gap_start is not None:
+                breaks.append(Break(gap_start, instant))
+                gap_start = None
+            instant += minute
+
+        return [ i for i in breaks if not i.is_short and not i.is_overnight ]
+
+    def has_nested_events(self, events: List[Event_]) -> bool:
+        by_start = sorted(events, key=lambda i: i.start)
+        return any(by_start[j].start <= by_start[k].start and by_start[k].end < by_start[j].end
+                   for j in range(len(by_start)) for k in range(j + 1, len(by_start)))
+
+    def as_tuples(self, breaks: List[Break]) -> List[tuple]:
+        return [ (i.start, i.end) for i in breaks ]
+
+    def test_matches_brute_force(self) -> None:
+        rng = random.Random(3002)
+        for _ in range(300):
+            events = random_events(rng)
+            self.assertEqual(self.as_tuples(get_breaks(events)),
+                             self.as_tuples(self.brute_force_breaks(events)), msg=events)
+
+    def test_matches_quadratic_without_nesting(self) -> None:
+        rng = random.Random(3200)
+        checked = 0
+        while checked < 300:
+            events = random_events(rng)
+            if self.has_nested_events(events):
+                continue
+            checked += 1
+            self.assertEqual(self.as_tuples(get_breaks(events)),
+                             self.as_tuples(quadratic_get_breaks(events)), msg=events)
+
+    def test_nested_event_covers_break(self) -> None:
+        at = lambda hour: self.DAY.replace(hour=hour)
+        events = [ Event_("A", "", at(9), at(12)), Event_("B", "", at(10), at(11)),
+                   Event_("C", "", at(13), at(14)) ]
+        self.assertEqual(self.as_tuples(get_breaks(events)), [ (at(12), at(13)) ])
+
+    def test_merged_real_calendars(self) -> None:
+        events = merged_calendars(10)
+        breaks = get_breaks(events)
+        self.assertNotEqual(breaks, [])
+        for brk in breaks:
+            self.assertFalse(any(i.start < brk.end and brk.start < i.end for i in events))
+
+
+@unittest.skipUnless(intervals.NUMPY_AVAILABLE, "NumPy is not installed")
+class TestVectorizedBreaks(unittest.TestCase):
+    def make_user(self, calendar: str) -> User:
+        user = User(calendar, "email", f"fb_{calendar}", "fb_access_token")
+        with open(f"./calendars/{calendar}.ics", "rb") as f:
+            user.calendar_data = f.read()
+        return user
+
+    def as_tuples(self, breaks: List[Break]) -> List[tuple]:
+        return [ (i.start, i.end) for i in breaks ]
+
+    def test_matches_sweep(self) -> None:
+        group = { self.make_user(i) for i in ("max", "charlie", "hugo") }
+        merged = [ event for user in group for event in user.events ]
+
+        self.assertEqual(self.as_tuples(get_shared_breaks_vectorized(group)),
+                         self.as_tuples(get_breaks(merged)))
+
+    def test_random_gaps_match_sweep(self) -> None:
+        rng = random.Random(4004)
+        for _ in range(200):
+            calendars = [ random_events(rng) for _ in range(3) ]
+            gaps = intervals.get_gaps([ intervals.encode(i) for i in calendars ])
+            breaks = [ Break(datetime.datetime.fromtimestamp(start, BRISBANE_TIME_ZONE),
+                             datetime.datetime.fromtimestamp(end, BRISBANE_TIME_ZONE))
+                       for start, end in gaps ]
+            breaks = [ i for i in breaks if not i.is_short and not i.is_overnight ]
+
+            merged = [ event for events in calendars for event in events ]
+            self.assertEqual(self.as_tuples(breaks), self.as_tuples(get_breaks(merged)))
+
+    def test_falls_back_without_numpy(self) -> None:
+        with app.app_context():
+            app.config['BREAKS_ENGINE'] = "numpy"
+            try:
+                self.assertEqual(get_breaks_engine(), "numpy")
+                with mock.patch.object(intervals, "NUMPY_AVAILABLE", False):
+                    self.assertEqual(get_breaks_engine(), "python")
+            finally:
+                app.config['BREAKS_ENGINE'] = "python"
+
+
+class TestBitsets(unittest.TestCase):
+    WEEK_START = datetime.datetime(2017, 3, 27, tzinfo=BRISBANE_TIME_ZONE)
+
+    def as_tuples(self, breaks: List[Break]) -> List[tuple]:
+        return [ (i.start, i.end) for i in breaks ]
+
+    def test_random_gaps_match_sweep(self) -> None:
+        rng = random.Random(1808)
+        for _ in range(200):
+            calendars = [ random_events(rng) for _ in range(rng.randint(1, 6)) ]
+            bitmaps = [ bitsets.encode_week(i, self.WEEK_START) for i in calendars ]
+            breaks = [ Break(start, end) for start, end in bitsets.get_gaps(bitmaps, self.WEEK_START) ]
+            breaks = [ i for i in breaks if not i.is_short ]
+
+            merged = [ event for events in calendars for event in events ]
+            expected = [ i for i in get_breaks(merged) if not i.is_short and not i.is_overnight ]
+            self.assertEqual(self.as_tuples(breaks), self.as_tuples(expected))
+
+    def test_rounds_outwards(self) -> None:
+        start = self.WEEK_START + datetime.timedelta(hours=6, minutes=50)
+        event = Event_("SUBJ1000 L01", "Building 1", start, start + datetime.timedelta(minutes=22))
+        # 7:00 to 7:12 is busy, so the slots up to 7:15 are too
+        self.assertEqual(bitsets.encode_week([event], self.WEEK_START), 0b111)
+
+    def test_matches_python_engine(self) -> None:
+        group = set()
+        for name in ("max", "charlie", "hugo"):
+            user = User(name, "email", f"fb_{name}", "fb_access_token")
+            with open(f"./calendars/{name}.ics", "rb") as f:
+                user.calendar_data = f.read()
+            group.add(user)
+
+        context = EvaluationContext(datetime.datetime(2017, 4, 4, 11, tzinfo=BRISBANE_TIME_ZONE))
+        with app.app_context():
+            expected = get_remaining_shared_breaks_this_week(group, context)
+            app.config['BREAKS_ENGINE'] = "bitset"
+            try:
+                breaks = get_remaining_shared_breaks_this_week(group, context)
+            finally:
+                app.config['BREAKS_ENGINE'] = "python"
+
+        self.assertNotEqual(breaks, [])
+        self.assertEqual(self.as_tuples(breaks), self.as_tuples(expected))
+
+    def test_remove_calendar_invalidates(self) -> None:
+        user = User("bitset", "email", "fb_bitset", "fb_access_token")
+        with open("./calendars/max.ics", "rb") as f:
+            user.calendar_data = f.read()
+
+        user.get_week_bitmap(self.WEEK_START)
+        self.assertIn(user.calendar_version, WEEK_BITMAPS)
+        version = user.calendar_version
+        user.remove_calendar()
+        self.assertNotIn(version, WEEK_BITMAPS)
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Runs each test inside an app context against a fresh in-memory database
+    """
+
+    def setUp(self) -> None:
+        self.context = app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+        PARSED_CALENDARS.clear()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        self.context.pop()
+
+    def make_user(self, name: str, calendar: Optional[str] = None) -> User:
+        user = User(name, "email", f"fb_{name}", "fb_access_token")
+
+        if calendar is not None:
+            with open(f"./calendars/{calendar}.ics", "rb") as f:
+                user.calendar_data = f.read()
+            user.store_events(get_events(user.calendar))
+
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def befriend(self, user: User, friend: User) -> None:
+        db.session.add(HasFriend(user.fb_user_id, friend.fb_user_id))
+        db.session.add(HasFriend(friend.fb_user_id, user.fb_user_id))
+        db.session.commit()
+
+    def login(self, user: User) -> Any:
+        """
+        Returns a test client, logged in as the given user
+        """
+        client = app.test_client()
+        client.post("/fb-login", json={ "userID": user.fb_user_id,
+                                        "userName": user.username,
+                                        "email": user.email,
+                                        "accessToken": "fb_access_token" })
+        return client
+
+    @contextmanager
+    def count_queries(self) -> Iterator[List[str]]:
+        """
+        Collects the SQL statements run inside the `with` block
+        """
+        statements: List[str] = []
+
+        def record(conn, cursor, statement, *args) -> None:
+            statements.append(statement)
+
+        sqlalchemy.event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            sqlalchemy.event.remove(db.engine, "before_cursor_execute", record)
+
+
+class TestPeriods(unittest.TestCase):
+    def test_compact(self) -> None:
+        with open("./calendars/max.ics", "rb") as f:
+            events = get_events(Calendar.from_ical(f.read()))
+
+        self.assertFalse(any(hasattr(i, "__dict__") for i in events))
+        self.assertTrue(all(type(i.summary) is str for i in events))
+
+        lectures = [ i for i in events if i.summary == "LING1000 L01" ]
+        self.assertGreater(len(lectures), 1)
+        self.assertTrue(all(i.summary is lectures[0].summary for i in lectures))
+        self.assertEqual(lectures[0].start_epoch, int(lectures[0].start.timestamp()))
+
+    def test_break(self) -> None:
+        at = lambda hour, minute=0: datetime.datetime(2017, 3, 27, hour, minute,
+                                                      tzinfo=BRISBANE_TIME_ZONE)
+        brk = Break(at(10), at(10, 10))
+
+        self.assertIn(at(10, 5), brk)
+        self.assertTrue(brk.is_short)
+        self.assertFalse(brk.is_overnight)
+        self.assertEqual(brk.to_dict(), { "start": "10:00", "end": "10:10", "day": "Monday" })
+        self.assertRaises(AttributeError, setattr, brk, "summary", "Free")
+
+
+class TestEventIndex(unittest.TestCase):
+    """
+    Checks the bisecting and bucketing `EventIndex` against linear scans, over
+    random calendars
+    """
+
+    def test_matches_linear_scans(self) -> None:
+        rng = random.Random(14)
+
+        for _ in range(200):
+            events = random_events(rng)
+            index = EventIndex(events)
+            by_start = sorted(events, key=lambda i: i.start)
+            instant = datetime.datetime(2017, 3, 27, 8, tzinfo=BRISBANE_TIME_ZONE) +\
+                datetime.timedelta(days=rng.randint(-1, 3), minutes=5 * rng.randint(0, 200))
+
+            self.assertEqual(index.on_day(instant),
+                             [ i for i in by_start if i.start.date() == instant.date() ])
+            self.assertEqual(index.in_week(instant),
+                             get_this_weeks_events(instant, by_start))
+            self.assertEqual(index.current(instant),
+                             next((i for i in by_start if instant in i), None))
+            self.assertEqual(index.next(instant),
+                             next((i for i in by_start if instant < i.start), None))
+
+            day = get_day_period(instant)
+            self.assertEqual(index.between(day.start, day.end),
+                             [ i for i in by_start if i.start in day ])
+
+    def test_utc_calendar(self) -> None:
+        """
+        Events are bucketed by their day in Brisbane, not the day in whatever
+        timezone the calendar happens to use
+        """
+        data = (b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+                b"BEGIN:VEVENT\r\nDTSTART:20170328T220000Z\r\nDTEND:20170328T230000Z\r\n"
+                b"SUMMARY:CSSE3002 L01\r\nLOCATION:Room\r\nEND:VEVENT\r\n"
+                b"BEGIN:VEVENT\r\nDTSTART:20170402T150000Z\r\nDTEND:20170402T160000Z\r\n"
+                b"SUMMARY:COMP3506 L01\r\nLOCATION:Room\r\nEND:VEVENT\r\n"
+                b"END:VCALENDAR\r\n")
+        index = EventIndex(parse_calendar(data))
+        tuesday = datetime.datetime(2017, 3, 28, 12, tzinfo=BRISBANE_TIME_ZONE)
+        wednesday = datetime.datetime(2017, 3, 29, 12, tzinfo=BRISBANE_TIME_ZONE)
+        next_monday = datetime.datetime(2017, 4, 3, 12, tzinfo=BRISBANE_TIME_ZONE)
+
+        self.assertEqual(index.on_day(tuesday), [])
+        self.assertEqual([ i.summary for i in index.on_day(wednesday) ], [ "CSSE3002 L01" ])
+        self.assertEqual([ i.summary for i in index.in_week(wednesday) ], [ "CSSE3002 L01" ])
+        self.assertEqual([ i.summary for i in index.in_week(next_monday) ], [ "COMP3506 L01" ])
+        # 8am on Wednesday in Brisbane is still Tuesday in UTC
+        early = datetime.datetime(2017, 3, 29, 8, tzinfo=BRISBANE_TIME_ZONE)
+        self.assertEqual(index.on_day(early.astimezone(datetime.timezone.utc)),
+                         index.on_day(wednesday))
+
+    def test_timetable(self) -> None:
+        me = User("me", "email", "fb_me", "fb_access_token")
+        with open("./calendars/max.ics", "rb") as f:
+            me.calendar_data = f.read()
+
+        now = datetime.datetime(2017, 3, 29, 12, tzinfo=BRISBANE_TIME_ZONE)
+        with mock.patch("backend.models.datetime") as mock_datetime:
+            mock_datetime.now.return_value = now
+            timetable = me.timetable
+
+        self.assertEqual(timetable, weeks_events_to_dictionary(
+            get_this_weeks_events(now, me.events)))
+        self.assertNotEqual(timetable["wednesday"], [])
+
+
+class TestPairwiseBreaks(unittest.TestCase):
+    """
+    Checks pairwise shared breaks against merging both calendars in full, over
+    random calendars and times
+    """
+
+    def test_matches_merging(self) -> None:
+        rng = random.Random(17)
+
+        for _ in range(300):
+            mine, theirs = random_events(rng), random_events(rng)
+            now = datetime.datetime(2017, 3, 26, 8, tzinfo=BRISBANE_TIME_ZONE) +\
+                datetime.timedelta(days=rng.randint(0, 4), minutes=5 * rng.randint(0, 200))
+
+            def blocks(events: List[Event_]) -> List[Tuple]:
+                window = get_remaining_week_window(now)
+                overlapping = EventIndex(events).overlapping(window.start, window.end)
+                return get_busy_blocks((i.start, i.end) for i in overlapping)
+
+            merged = cull_past_breaks(get_breaks(mine + theirs), now)
+            expected = get_this_weeks_events(now, merged)
+            result = get_pairwise_breaks(blocks(mine), blocks(theirs), now)
+
+            self.assertEqual([ (i.start, i.end) for i in result ],
+                             [ (i.start, i.end) for i in expected ])
+
+    def test_semester_calendars(self) -> None:
+        me, friend = [ User(i, "email", f"fb_{i}", "fb_access_token") for i in ("max", "hugo") ]
+        for user in (me, friend):
+            with open(f"./calendars/{user.username}.ics", "rb") as f:
+                user.calendar_data = f.read()
+
+        now = datetime.datetime(2017, 2, 27, 0, 0, tzinfo=BRISBANE_TIME_ZONE)
+        while now.month < 6:
+            context = EvaluationContext(now)
+            expected = get_this_weeks_events(now, cull_past_breaks(
+                get_breaks(me.events + friend.events), now))
+
+            self.assertEqual([ i.to_dict() for i in get_remaining_pairwise_breaks(me, friend, context) ],
+                             [ i.to_dict() for i in expected ])
+            now += datetime.timedelta(hours=7, minutes=13)
+
+
+class TestStoredEvents(DatabaseTestCase):
+    def test_week_range_query(self) -> None:
+        me = self.make_user("stored", "max")
+        instant = datetime.datetime(2017, 3, 29, 12, tzinfo=BRISBANE_TIME_ZONE)
+        week = get_week_period(instant)
+
+        expected = get_this_weeks_events(instant, get_events(me.calendar))
+        result = me.event_index.between(week.start, week.end)
+
+        self.assertNotEqual(result, [])
+        self.assertEqual([ (i.summary, i.location, i.start, i.end) for i in result ],
+                         [ (i.summary, i.location, i.start, i.end) for i in expected ])
+
+    def test_skips_parsing(self) -> None:
+        me = self.make_user("stored", "max")
+        me.calendar_data = b"garbage"
+        self.assertTrue(me.has_stored_events)
+        self.assertNotEqual(me.events, [])
+
+    def test_remove_calendar(self) -> None:
+        me = self.make_user("stored", "max")
+        me.remove_calendar()
+        db.session.commit()
+        self.assertFalse(me.has_stored_events)
+        self.assertEqual(CalendarEvent.query.count(), 0)
+
+
+class TestConfirmedFriends(DatabaseTestCase):
+    def test_only_mutual_friends(self) -> None:
+        me = self.make_user("me")
+        friend = self.make_user("friend")
+        pending = self.make_user("pending")
+        self.befriend(me, friend)
+        db.session.add(HasFriend(me.fb_user_id, pending.fb_user_id))
+        db.session.commit()
+
+        self.assertEqual(me.confirmed_friends, [ friend ])
+        self.assertEqual(pending.confirmed_friends, [])
+
+    def test_constant_query_count(self) -> None:
+        def queries_with_friends(count: int) -> int:
+            me = self.make_user(f"me_{count}")
+            for i in range(count):
+                self.befriend(me, self.make_user(f"friend_{count}_{i}"))
+            db.session.expire_all()
+
+            with self.count_queries() as statements:
+                friends = me.confirmed_friends
+
+            self.assertEqual(len(friends), count)
+            return len(statements)
+
+        self.assertEqual(queries_with_friends(1), queries_with_friends(10))
+
+
+class TestFacebookFriends(DatabaseTestCase):
+    def test_request_statuses(self) -> None:
+        me = self.make_user("me")
+        friends = { status: self.make_user(status) for status in
+                    ("friends", "accept", "pending", "not_added") }
+        self.make_user("stranger")
+
+        self.befriend(me, friends["friends"])
+        db.session.add(HasFriend(friends["accept"].fb_user_id, me.fb_user_id))
+        db.session.add(HasFriend(me.fb_user_id, friends["pending"].fb_user_id))
+        me.sync_fb_friends(i.fb_user_id for i in friends.values())
+        db.session.commit()
+
+        response = self.login(me).get("/fb-friends").get_json()["data"]
+
+        self.assertEqual([ (i["fbId"], i["requestStatus"]) for i in response ],
+                         [ ("fb_friends", "Friends"), ("fb_accept", "Accept"),
+                           ("fb_pending", "Pending"), ("fb_not_added", "Not Added") ])
+
+    def test_constant_query_count(self) -> None:
+        def queries_with_friends(count: int) -> int:
+            me = self.make_user(f"me_{count}")
+            friends = [ self.make_user(f"friend_{count}_{i}") for i in range(count) ]
+            for friend in friends[::2]:
+                self.befriend(me, friend)
+            me.sync_fb_friends(i.fb_user_id for i in friends)
+            db.session.commit()
+
+            client = self.login(me)
+            with self.count_queries() as statements:
+                response = client.get("/fb-friends").get_json()["data"]
+
+            self.assertEqual(len(response), count)
+            return len(statements)
+
+        self.assertEqual(queries_with_friends(2), queries_with_friends(20))
+
+    def test_sync_only_touches_changes(self) -> None:
+        me = self.make_user("me")
+        me.sync_fb_friends([ "a", "b", "c", me.fb_user_id ])
+        db.session.commit()
+        self.assertEqual(me.fb_friend_ids, { "a", "b", "c" })
+
+        with self.count_queries() as statements:
+            me.sync_fb_friends([ "b", "c", "d" ])
+            db.session.commit()
+
+        self.assertEqual(me.fb_friend_ids, { "b", "c", "d" })
+        writes = [ i for i in statements if i.split()[0] in ("INSERT", "DELETE") ]
+        self.assertEqual(len(writes), 2)
+
+    def test_post(self) -> None:
+        me = self.make_user("me")
+        client = self.login(me)
+        client.post("/fb-friends", json={ "friends": [ { "id": "a" }, { "id": "b" } ] })
+        self.assertEqual(me.fb_friend_ids, { "a", "b" })
+
+
+class CalendarHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves `server.calendars`, a dictionary of paths to calendar data, with
+    strong ETags
+    """
+
+    def do_GET(self) -> None:
+        data = self.server.calendars.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        etag = f'"{content_hash(data)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class CalendarServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class TestCalendarRefresher(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.server = CalendarServer(("127.0.0.1", 0), CalendarHandler)
+        self.server.calendars = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def serve(self, path: str, calendar: str) -> str:
+        with open(f"./calendars/{calendar}.ics", "rb") as f:
+            self.server.calendars[path] = f.read()
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def test_refresh(self) -> None:
+        me = self.make_user("me", "max")
+        me.calendar_url = self.serve("/share/me.ics", "charlie")
+        db.session.commit()
+
+        first = CalendarRefresher(concurrency=2).refresh_all()
+        self.assertEqual((first.fetched, first.updated, first.unchanged, first.failed), (1, 1, 0, 0))
+        self.assertEqual(first.bytes, len(self.server.calendars["/share/me.ics"]))
+        self.assertEqual(me.calendar_data, self.server.calendars["/share/me.ics"])
+        self.assertIsNotNone(me.calendar_etag)
+
+        second = CalendarRefresher(concurrency=2).refresh_all()
+        self.assertEqual((second.fetched, second.unchanged, second.bytes), (0, 1, 0))
+
+    def test_failures(self) -> None:
+        me = self.make_user("me", "max")
+        me.calendar_url = self.serve("/share/me.ics", "broken")
+        friend = self.make_user("friend", "hugo")
+        friend.calendar_url = self.serve("/share/missing.ics", "charlie")
+        del self.server.calendars["/share/missing.ics"]
+        db.session.commit()
+
+        stats = CalendarRefresher(concurrency=2).refresh_all()
+        self.assertEqual((stats.fetched, stats.updated, stats.failed), (1, 0, 2))
+        self.assertNotEqual(me.calendar_data, b"")
+
+    def test_applies_as_downloads_arrive(self) -> None:
+        for i in range(12):
+            user = self.make_user(f"user_{i}", "max")
+            user.calendar_url = self.serve(f"/share/{i}.ics", "charlie")
+        db.session.commit()
+
+        refresher = CalendarRefresher(concurrency=2)
+        fetch, apply = refresher.fetch, refresher.apply
+        held = [ 0 ]
+        most_held = [ 0 ]
+
+        def counting_fetch(*args: Any) -> Any:
+            result = fetch(*args)
+            held[0] += 1
+            most_held[0] = max(most_held[0], held[0])
+            return result
+
+        def counting_apply(*args: Any) -> None:
+            held[0] -= 1
+            apply(*args)
+
+        with mock.patch.object(refresher, "fetch", counting_fetch), \
+                mock.patch.object(refresher, "apply", counting_apply):
+            stats = refresher.refresh_all()
+
+        self.assertEqual(stats.updated, 12)
+        self.assertLessEqual(most_held[0], 4)
+
+    def test_skips_stale_downloads(self) -> None:
+        replaced = self.make_user("replaced", "max")
+        removed = self.make_user("removed", "max")
+        deleted = self.make_user("deleted", "max")
+        for user in (replaced, removed, deleted):
+            user.calendar_url = self.serve(f"/share/{user.username}.ics", "charlie")
+        db.session.commit()
+
+        refresher = CalendarRefresher()
+        downloads = [ refresher.fetch(i.id, i.calendar_url, None, None)
+                      for i in (replaced, removed, deleted) ]
+
+        with open("./calendars/hugo.ics", "rb") as f:
+            replaced.update_calendar("https://example.com/hugo.ics", f.read())
+        removed.remove_calendar()
+        db.session.delete(deleted)
+        db.session.commit()
+
+        stats = RefreshStats()
+        for download in downloads:
+            refresher.apply(download, stats)
+
+        self.assertEqual((stats.fetched, stats.updated, stats.failed), (3, 0, 0))
+        self.assertEqual(replaced.calendar_url, "https://example.com/hugo.ics")
+        self.assertIsNone(removed.calendar_data)
+        self.assertEqual(removed.calendar_url, "")
+
+    def test_worker_outlives_failed_runs(self) -> None:
+        runner = CliRunner()
+        info = ScriptInfo(create_app=lambda *args: app)
+
+        with mock.patch.object(CalendarRefresher, "refresh_all", side_effect=RuntimeError("Oops")), \
+                mock.patch.object(time, "sleep", side_effect=[ None, KeyboardInterrupt ]) as sleep:
+            with self.assertLogs(level="ERROR") as logs:
+                runner.invoke(refresh_calendars, [ "--every", "60" ], obj=info)
+            self.assertEqual(sleep.call_count, 2)
+            self.assertEqual(len(logs.records), 2)
+
+            result = runner.invoke(refresh_calendars, [], obj=info)
+            self.assertIsInstance(result.exception, RuntimeError)
+
+
+class TestCalendarImport(DatabaseTestCase):
+    URL = "https://timetableplanner.app.uq.edu.au/share/me.ics"
+
+    def urlopen(self, calendar: str) -> Any:
+        with open(f"./calendars/{calendar}.ics", "rb") as f:
+            response = io.BytesIO(f.read())
+        response.headers = {}
+        return mock.patch.object(urllib.request, "urlopen", return_value=response)
+
+    def import_calendar(self, client: Any) -> Any:
+        """
+        POSTs the calendar URL, then polls the job once it has finished.
+
+        NOTE: The in-memory test database is a single connection, so we can't
+            poll while the job is using it
+        """
+        response = client.post("/calendar", json={ "url": self.URL })
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json()["data"]["status"], CalendarImport.PENDING)
+
+        self.assertTrue(jobs.join(timeout=10))
+        return client.get(response.headers["Location"])
+
+    def test_import(self) -> None:
+        me = self.make_user("me")
+        client = self.login(me)
+
+        with self.urlopen("max"):
+            response = self.import_calendar(client)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIn("monday", response.get_json()["data"])
+
+        db.session.refresh(me)
+        self.assertEqual(me.calendar_url, self.URL)
+        self.assertTrue(me.has_stored_events)
+
+    def test_invalid_calendar(self) -> None:
+        client = self.login(self.make_user("me"))
+
+        with self.urlopen("broken"):
+            response = self.import_calendar(client)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()["error"]["message"], "Invalid Calendar")
+
+    def test_download_failure(self) -> None:
+        client = self.login(self.make_user("me"))
+
+        with mock.patch.object(urllib.request, "urlopen", side_effect=urllib.error.URLError("timed out")):
+            response = self.import_calendar(client)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()["error"]["message"], "Could not download the calendar")
+
+    def test_abandoned_job(self) -> None:
+        me = self.make_user("me")
+        job = start_calendar_import(me, self.URL)
+        job.status = CalendarImport.RUNNING
+        job.started = datetime.datetime.utcnow() - datetime.timedelta(seconds=CALENDAR_IMPORT_TIMEOUT + 1)
+        db.session.commit()
+
+        response = self.login(me).get(f"/calendar/jobs/{job.id}")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()["error"]["message"], "Timed out importing the calendar")
+        self.assertEqual(CalendarImport.query.get(job.id).status, CalendarImport.FAILED)
+
+    def test_running_job(self) -> None:
+        me = self.make_user("me")
+        job = start_calendar_import(me, self.URL)
+        db.session.commit()
+
+        response = self.login(me).get(f"/calendar/jobs/{job.id}")
+        self.assertEqual(response.status_code, 202)
+
+    def test_queued_job(self) -> None:
+        me = self.make_user("me")
+        job = start_calendar_import(me, self.URL)
+        job.created -= datetime.timedelta(seconds=CALENDAR_IMPORT_TIMEOUT + 1)
+        db.session.commit()
+
+        response = self.login(me).get(f"/calendar/jobs/{job.id}")
+        self.assertEqual(response.status_code, 202)
+
+    def test_failed_job_is_not_run(self) -> None:
+        me = self.make_user("me")
+        job = start_calendar_import(me, self.URL)
+        job.status = CalendarImport.FAILED
+        db.session.commit()
+
+        with self.urlopen("max") as urlopen:
+            run_calendar_import(job.id)
+
+        urlopen.assert_not_called()
+        self.assertEqual(job.status, CalendarImport.FAILED)
+        self.assertIsNone(me.calendar_data)
+
+    def test_other_users_jobs(self) -> None:
+        me = self.make_user("me")
+        job = start_calendar_import(me, self.URL)
+        db.session.commit()
+
+        response = self.login(self.make_user("friend")).get(f"/calendar/jobs/{job.id}")
+        self.assertEqual(response.status_code, 404)
+
+
+class TestETags(DatabaseTestCase):
+    NOW = datetime.datetime(2017, 3, 28, 12, 30, tzinfo=BRISBANE_TIME_ZONE)
+
+    def get_twice(self, client: Any, url: str) -> Tuple[Any, Any]:
+        """
+        GETs `url`, then GETs it again with the ETag of the first response
+        """
+        first = client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("ETag", first.headers)
+
+        second = client.get(url, headers={ "If-None-Match": first.headers["ETag"] })
+        return first, second
+
+    def test_content_etag(self) -> None:
+        client = self.login(self.make_user("me"))
+        first, second = self.get_twice(client, "/profile")
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.get_data(), b"")
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(first.headers["Cache-Control"], "private, no-cache")
+
+    def test_calendar_version(self) -> None:
+        me = self.make_user("me", "max")
+        client = self.login(me)
+
+        with mock.patch.object(User, "timetable", new_callable=mock.PropertyMock,
+                               return_value={ "monday": [] }) as timetable:
+            first, second = self.get_twice(client, "/calendar")
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(timetable.call_count, 1)
+
+        with open("./calendars/charlie.ics", "rb") as f:
+            me.update_calendar("", f.read())
+        db.session.commit()
+
+        third = client.get("/calendar", headers={ "If-None-Match": first.headers["ETag"] })
+        self.assertEqual(third.status_code, 200)
+
+    def test_statuses_version(self) -> None:
+        me = self.make_user("me", "max")
+        friend = self.make_user("friend", "charlie")
+        self.befriend(me, friend)
+        client = self.login(me)
+
+        changes = [ j for i in me.events + friend.events for j in (i.start, i.end)
+                    if j > self.NOW ]
+        next_change = min(changes)
+
+        def get(now: datetime.datetime, etag: str = "") -> Any:
+            with mock.patch("app.EvaluationContext", lambda: EvaluationContext(now)):
+                return client.get("/statuses", headers={ "If-None-Match": etag })
+
+        first = get(self.NOW)
+        etag = first.headers["ETag"]
+
+        with mock.patch.object(User, "availability") as availability:
+            self.assertEqual(get(next_change - datetime.timedelta(minutes=1), etag).status_code, 304)
+        availability.assert_not_called()
+
+        self.assertEqual(get(next_change, etag).status_code, 200)
+
+        friend.incognito = True
+        db.session.commit()
+        self.assertEqual(get(self.NOW, etag).status_code, 200)
+
+
+class TestStatusStream(DatabaseTestCase):
+    START = datetime.datetime(2017, 3, 28, 6, tzinfo=BRISBANE_TIME_ZONE)
+    END = datetime.datetime(2017, 3, 29, 6, tzinfo=BRISBANE_TIME_ZONE)
+
+    def test_pushes_each_change(self) -> None:
+        me = self.make_user("me", "max")
+        friend = self.make_user("charlie", "charlie")
+        self.befriend(me, friend)
+
+        now = [ self.START ]
+        def sleep(seconds: float) -> None:
+            self.assertLessEqual(seconds, app.config['STATUS_STREAM_HEARTBEAT'])
+            now[0] += datetime.timedelta(seconds=seconds)
+
+        pushed: Dict[str, List[tuple]] = { "fb_me": [], "fb_charlie": [] }
+        for event in stream_statuses(me, clock=lambda: now[0], sleep=sleep):
+            if now[0] > self.END:
+                break
+            if event.startswith("event: status"):
+                status = json.loads(event.split("data: ")[1])["data"]
+                pushed[status["fbId"]].append((status["status"], status["statusInfo"]))
+
+        # Every change we'd have seen by asking each minute, and nothing else
+        for user in (me, friend):
+            expected: List[tuple] = []
+            instant = self.START
+            while instant <= self.END:
+                status = user.get_status(EvaluationContext(instant))
+                if expected[-1:] != [ (status["status"], status["statusInfo"]) ]:
+                    expected.append((status["status"], status["statusInfo"]))
+                instant += datetime.timedelta(minutes=1)
+
+            self.assertGreater(len(expected), 3)
+            self.assertEqual(pushed[user.fb_user_id], expected)
+
+    def test_off_by_default(self) -> None:
+        me = self.make_user("me", "max")
+        response = self.login(me).get("/statuses/stream")
+        self.assertEqual(response.status_code, 204)
+
+    def test_streams(self) -> None:
+        me = self.make_user("me", "max")
+        app.config['STATUS_STREAM'] = True
+        try:
+            response = self.login(me).get("/statuses/stream")
+            self.assertEqual(response.mimetype, "text/event-stream")
+            first = next(response.response)
+            response.close()
+        finally:
+            app.config['STATUS_STREAM'] = False
+
+        self.assertIn("event: status", first if isinstance(first, str) else first.decode())
+
+
+class TestMetrics(DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        metrics.REGISTRY.clear()
+
+    def scrape(self, client: Any, token: str = "secret") -> Any:
+        with mock.patch.dict(app.config, { "METRICS_TOKEN": "secret" }):
+            return client.get("/metrics", headers={ "Authorization": f"Bearer {token}" })
+
+    def test_needs_token(self) -> None:
+        client = app.test_client()
+        self.assertEqual(client.get("/metrics").status_code, 404)
+        self.assertEqual(self.scrape(client, token="guess").status_code, 403)
+        self.assertEqual(self.scrape(client).status_code, 200)
+
+    def test_records_failures(self) -> None:
+        client = self.login(self.make_user("me", "max"))
+
+        with mock.patch.object(User, "availability", side_effect=RuntimeError("boom")), \
+                mock.patch.dict(app.config, { "PROPAGATE_EXCEPTIONS": True }):
+            self.assertRaises(RuntimeError, client.get, "/statuses")
+
+        self.assertIn('suq_http_request_duration_seconds_count'
+                      '{endpoint="statuses",method="GET",status="500"} 1',
+                      metrics.REGISTRY.render())
+
+    def test_histogram(self) -> None:
+        registry = metrics.Registry()
+        for value in (0.003, 0.2, 0.2, 20):
+            registry.observe("suq_ics_parse_duration_seconds", value, parser="fast")
+        text = registry.render()
+
+        self.assertIn('suq_ics_parse_duration_seconds_bucket{parser="fast",le="0.005"} 1', text)
+        self.assertIn('suq_ics_parse_duration_seconds_bucket{parser="fast",le="0.25"} 3', text)
+        self.assertIn('suq_ics_parse_duration_seconds_bucket{parser="fast",le="+Inf"} 4', text)
+        self.assertIn('suq_ics_parse_duration_seconds_count{parser="fast"} 4', text)
+
+    def test_records_requests_and_queries(self) -> None:
+        me = self.make_user("me", "max")
+        client = self.login(me)
+        PARSED_CALENDARS.clear()
+        client.get("/statuses")
+
+        text = self.scrape(client).get_data(as_text=True)
+        self.assertIn('suq_http_request_duration_seconds_count'
+                      '{endpoint="statuses",method="GET",status="200"} 1', text)
+        self.assertRegex(text, r'suq_db_queries_total\{endpoint="statuses"\} [1-9]')
+        self.assertIn("# TYPE suq_outbound_request_duration_seconds histogram", text)
+
+    def test_failed_queries_dont_leak(self) -> None:
+        for _ in range(3):
+            with self.assertRaises(sqlalchemy.exc.OperationalError):
+                db.session.execute(sqlalchemy.text("SELECT * FROM Missing"))
+            db.session.rollback()
+
+        db.session.execute(sqlalchemy.text("SELECT 1"))
+        self.assertNotIn("query_started_at", db.session.connection().info)
+
+    def test_records_parses(self) -> None:
+        with open("./calendars/max.ics", "rb") as f:
+            parse_calendar(f.read())
+        self.assertIn('suq_ics_parse_duration_seconds_count{parser="fast"} 1',
+                      metrics.REGISTRY.render())
+
+    def test_adds_up_workers(self) -> None:
+        other = metrics.Registry()
+        other.inc("suq_db_queries_total", 2, endpoint="whats_due")
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, f"{os.getppid()}.json"), "w") as f:
+                json.dump(other.snapshot(), f)
+            metrics.REGISTRY.inc("suq_db_queries_total", 3, endpoint="whats_due")
+            metrics.flush(directory, force=True)
+
+            text = metrics.collect(directory)
+
+        self.assertIn('suq_db_queries_total{endpoint="whats_due"} 5', text)
+
+    def test_skips_exited_workers(self) -> None:
+        exited = subprocess.Popen([ sys.executable, "-c", "pass" ])
+        exited.wait()
+        other = metrics.Registry()
+        other.inc("suq_db_queries_total", 2, endpoint="whats_due")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"{exited.pid}.json")
+            with open(path, "w") as f:
+                json.dump(other.snapshot(), f)
+
+            self.assertNotIn('endpoint="whats_due"', metrics.collect(directory))
+            self.assertTrue(os.path.exists(path))
+
+            worker = Flask("worker")
+            worker.config['METRICS_DIR'] = directory
+            metrics.init_app(worker)
+            self.assertFalse(os.path.exists(path))
+
+
+class TestEvaluationContext(DatabaseTestCase):
+    NOW = datetime.datetime(2017, 3, 28, 12, 30, tzinfo=BRISBANE_TIME_ZONE)
+
+    def test_status_is_memoized(self) -> None:
+        me = self.make_user("me", "max")
+        context = EvaluationContext(self.NOW)
+
+        with mock.patch.object(User, "_compute_status", autospec=True,
+                               side_effect=User._compute_status) as query:
+            first = me.get_status(context)
+            second = me.get_status(context)
+
+        self.assertIs(first, second)
+        self.assertEqual(query.call_count, 1)
+
+    def test_current_users_events_are_fetched_once(self) -> None:
+        me = self.make_user("me", "max")
+        friends = [ self.make_user(i, i) for i in ("charlie", "hugo") ]
+        context = EvaluationContext(self.NOW)
+
+        for friend in friends:
+            friend.availability(me, context)
+
+        # Every access to `User.events` looks the calendar up in the cache
+        lookups = PARSED_CALENDARS.hits + PARSED_CALENDARS.misses
+        self.assertEqual(lookups, 1 + len(friends))
+
+    def test_matches_fresh_context(self) -> None:
+        me = self.make_user("me", "max")
+        friend = self.make_user("charlie", "charlie")
+        context = EvaluationContext(self.NOW)
+        me.availability(me, context)
+
+        self.assertEqual(friend.availability(me, context),
+                         friend.availability(me, EvaluationContext(self.NOW)))
+
 # https://timetableplanner.app.uq.edu.au/share/NFpehMDzBlmaglRIg1z32w.ics
 class TestCalendarRetrieval(unittest.TestCase):
 
@@ -69,8 +1231,199 @@ class TestCalendarRetrieval(unittest.TestCase):
 
 
 class TestWhatsDue(unittest.TestCase):
+    COURSE_PAGE = '<a href="/profile?profileId={}">Course profile</a>'
+    ASSESSMENT_PAGE = (
+        '<table class="tblborder"><tr><th>Course</th><th>Task</th><th>Due</th><th>Weight</th></tr>'
+        '<tr><td>{} (St Lucia)</td><td>Essay</td><td>20 Mar 17 17:00</td><td>20%</td></tr>'
+        '<tr><td>{} (St Lucia)</td><td>Exam</td><td>Examination Period</td><td>80%</td></tr>'
+        '</table>')
+
+    def setUp(self) -> None:
+        middleware.configure_caches()
+        self.fetched: List[str] = []
+
+    def fetch(self, url: str) -> str:
+        self.fetched.append(url)
+        course = re.search(r'course_code=(\w+)', url)
+
+        if course is not None:
+            page = self.COURSE_PAGE.format(sum(map(ord, course.group(1))))
+        else:
+            profile_id = int(url.rsplit("=", 1)[1])
+            course = [ i for i in ("CSSE3002", "COMS3200") if sum(map(ord, i)) == profile_id ][0]
+            page = self.ASSESSMENT_PAGE.format(course, course)
+
+        return page
+
     def test_simple(self) -> None:
-        pass
+        with mock.patch.object(middleware, "fetch", self.fetch):
+            result = get_whats_due({ "csse3002", "coms3200" })
+
+        self.assertEqual([ (i["subject"], i["description"], i["completed"]) for i in result ],
+                         [ ("COMS3200", "Exam", False), ("CSSE3002", "Exam", False),
+                           ("COMS3200", "Essay", True), ("CSSE3002", "Essay", True) ])
+
+    def test_warm_cache_skips_uq(self) -> None:
+        with mock.patch.object(middleware, "fetch", self.fetch):
+            cold = get_whats_due({ "CSSE3002", "COMS3200" })
+            self.assertEqual(len(self.fetched), 4)
+            warm = get_whats_due({ "CSSE3002", "COMS3200" })
+
+        self.assertEqual(len(self.fetched), 4)
+        self.assertEqual(cold, warm)
+
+    def test_partial_results(self) -> None:
+        def fetch(url: str) -> str:
+            if "COMS3200" in url:
+                raise requests.exceptions.ConnectionError("Connection refused")
+            return self.fetch(url)
+
+        with mock.patch.object(middleware, "fetch", fetch):
+            result = get_whats_due({ "CSSE3002", "COMS3200" })
+
+        self.assertEqual({ i["subject"] for i in result }, { "CSSE3002" })
+
+    def test_deadline(self) -> None:
+        release = threading.Event()
+
+        def fetch(url: str) -> str:
+            if "COMS3200" in url:
+                release.wait()
+            return self.fetch(url)
+
+        try:
+            with mock.patch.object(middleware, "fetch", fetch), \
+                    mock.patch.object(middleware, "WHATS_DUE_DEADLINE", 0.2):
+                result = get_whats_due({ "CSSE3002", "COMS3200" })
+        finally:
+            release.set()
+
+        self.assertEqual({ i["subject"] for i in result }, { "CSSE3002" })
+
+    def test_ttl(self) -> None:
+        now = [ 0.0 ]
+        cache = TTLCache(ttl=10, clock=lambda: now[0])
+        cache.put("key", "value")
+        self.assertEqual(cache.get("key"), "value")
+        now[0] = 10
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_disk_cache_is_shared(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.db")
+            DiskTTLCache(path, "assessments", ttl=60).put("1234", [ [ "a", "b" ] ])
+            self.assertEqual(DiskTTLCache(path, "assessments", ttl=60).get("1234"),
+                             [ [ "a", "b" ] ])
+            self.assertIsNone(DiskTTLCache(path, "profile_ids", ttl=60).get("1234"))
+
+    def test_disk_cache_is_bounded(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskTTLCache(os.path.join(directory, "cache.db"), "test", ttl=60, maxsize=2)
+            for i in range(3):
+                cache.put(str(i), i)
+            self.assertIsNone(cache.get("0"))
+            self.assertEqual(cache.get("2"), 2)
+
+
+class TestStandIn(DatabaseTestCase):
+    """
+    Runs what's due, and calendar downloads, against `bench.standin`
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.standin = StandIn().start()
+        middleware.configure_caches()
+        middleware.configure_upstreams(self.standin.url, self.standin.url, self.standin.url)
+
+    def tearDown(self) -> None:
+        middleware.configure_upstreams()
+        middleware.configure_caches()
+        self.standin.stop()
+        super().tearDown()
+
+    def test_whats_due(self) -> None:
+        result = get_whats_due({ "CSSE3002", "COMS3200" })
+
+        self.assertEqual(len(result), 8)
+        self.assertEqual({ i["subject"] for i in result }, { "CSSE3002", "COMS3200" })
+        self.assertEqual([ i["description"] for i in result if not i["completed"] ],
+                         [ "Final Exam", "Final Exam" ])
+        self.assertEqual(self.standin.requests["/study/course.html"], 2)
+
+    def test_errors(self) -> None:
+        self.standin.error_rate = 1
+        self.assertEqual(get_whats_due({ "CSSE3002" }), [])
+
+    def test_slow_course(self) -> None:
+        self.standin.slow_rate = 1
+        self.standin.slow_seconds = 0.5
+
+        with mock.patch.object(middleware, "WHATS_DUE_DEADLINE", 0.1):
+            self.assertEqual(get_whats_due({ "CSSE3002" }), [])
+
+        # Lets the abandoned lookup finish against the stand-in, not UQ
+        self.standin.slow_rate = 0
+        time.sleep(0.6)
+
+    def test_calendar(self) -> None:
+        me = self.make_user("me")
+        me.add_calendar("https://timetableplanner.app.uq.edu.au/share/max.ics")
+
+        with open("./calendars/max.ics", "rb") as f:
+            self.assertEqual(me.calendar_data, f.read())
+        self.assertEqual(me.calendar_url, "https://timetableplanner.app.uq.edu.au/share/max.ics")
+        self.assertEqual(self.standin.requests["/share/max.ics"], 1)
+
+    def test_generated_calendar(self) -> None:
+        me = self.make_user("me")
+        me.add_calendar("https://timetableplanner.app.uq.edu.au/share/someone_else.ics")
+        self.assertTrue(len(me.events) > 0)
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_percentile(self) -> None:
+        values = [ i / 100 for i in range(1, 101) ]
+        self.assertEqual(percentile(values, 50), 0.5)
+        self.assertEqual(percentile(values, 99), 0.99)
+        self.assertEqual(percentile(values, 100), 1.0)
+        self.assertEqual(percentile([ 0.2 ], 95), 0.2)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_summarise(self) -> None:
+        results = Results()
+        for i in range(1, 11):
+            results.record("/statuses", i / 1000, failed=False)
+            results.record("/profile", i / 1000, failed=i > 8)
+
+        summary = summarise(results, elapsed=2)
+        self.assertEqual(summary["/statuses"]["requests"], 10)
+        self.assertEqual(summary["/statuses"]["rps"], 5)
+        self.assertEqual(summary["/statuses"]["p95_ms"], 10)
+        self.assertEqual(summary["/profile"]["error_rate"], 0.2)
+        self.assertEqual(summary["total"]["requests"], 20)
+        self.assertEqual(summary["total"]["p50_ms"], 5)
+        self.assertEqual(summary["total"]["error_rate"], 0.1)
+
+
+class TestStartup(DatabaseTestCase):
+    def test_import_is_lazy(self) -> None:
+        script = ("import sys, app; "
+                  "print([ i for i in ('icalendar', 'bs4', 'html5lib', 'numpy', 'requests') "
+                  "if i in sys.modules ])")
+        output = subprocess.check_output([ sys.executable, "-c", script ], cwd="..",
+                                         env=dict(os.environ, DATABASE_URL="sqlite://"),
+                                         stderr=subprocess.DEVNULL)
+        self.assertEqual(output.decode().strip(), "[]")
+
+    def test_init_db(self) -> None:
+        db.drop_all()
+        self.assertEqual(sqlalchemy.inspect(db.engine).get_table_names(), [])
+
+        result = app.test_cli_runner().invoke(args=[ "init-db" ])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Users", sqlalchemy.inspect(db.engine).get_table_names())
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,7 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Offline benchmarks. Run each module from the repository root, eg.
+
+    python -m bench.breaks
+"""
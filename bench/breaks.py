@@ -0,0 +1,128 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Times `get_breaks` against the quadratic implementation it replaced, and the
+NumPy engine (from already encoded calendars, as they are cached), over 1, 10
+and 50 merged semester calendars.
+
+Then times finding a week's shared breaks for groups of 10, 100 and 500 with
+the bitset engine, from already encoded weeks, against the sweep over that
+week's events.
+
+    python -m bench.breaks
+"""
+
+# Builtins
+import os
+import random
+import timeit
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List
+
+# Imports
+from backend import bitsets, intervals
+from backend.models import BRISBANE_TIME_ZONE, Break, Event_, get_breaks, get_events
+from icalendar import Calendar # type: ignore
+
+CALENDARS_DIR = os.path.join(os.path.dirname(__file__), "..", "backend", "calendars")
+
+
+def quadratic_get_breaks(events: List[Event_]) -> List[Break]:
+    """
+    The original `get_breaks`, kept as a baseline.
+
+    NOTE: This is incorrect when an event is nested inside an earlier one, as
+        the inner event's end gets treated as the end of the block
+    """
+    by_start = deque(sorted(events, key=lambda i: i.start))
+
+    breaks: List[Break] = []
+
+    while True:
+        if len(by_start) < 2:
+            return [i for i in breaks if not i.is_short and not i.is_overnight]
+
+        subject = by_start.popleft()
+
+        if any(subject.end in i for i in by_start):
+            continue
+        else:
+            breaks.append(Break(subject.end, by_start[0].start))
+
+
+def load_semesters() -> List[List[Event_]]:
+    semesters = []
+    for name in ("max", "charlie", "hugo"):
+        with open(os.path.join(CALENDARS_DIR, f"{name}.ics"), "rb") as f:
+            semesters.append(get_events(Calendar.from_ical(f.read())))
+    return semesters
+
+
+def group_calendars(count: int, seed: int = 0) -> List[List[Event_]]:
+    """
+    Makes `count` semesters, each a real calendar shifted by up to two hours
+    either way, so that members don't all share the same breaks
+    """
+    rng = random.Random(seed)
+    semesters = load_semesters()
+    group = []
+
+    for i in range(count):
+        shift = timedelta(minutes=10 * rng.randint(-12, 12))
+        group.append([ Event_(e.summary, e.location, e.start + shift, e.end + shift)
+                       for e in semesters[i % len(semesters)] ])
+
+    return group
+
+
+def merged_calendars(count: int, seed: int = 0) -> List[Event_]:
+    return [ event for events in group_calendars(count, seed) for event in events ]
+
+
+def main() -> None:
+    print(f"{'calendars':>10} {'events':>8} {'sweep (ms)':>12} "
+          f"{'quadratic (ms)':>15} {'numpy (ms)':>12}")
+
+    for count in (1, 10, 50):
+        group = group_calendars(count)
+        events = [ event for events in group for event in events ]
+        runs = 5 if count < 50 else 1
+
+        def time(f) -> str:
+            return f"{min(timeit.repeat(f, number=1, repeat=runs)) * 1000:.2f}"
+
+        sweep = time(lambda: get_breaks(events))
+        quadratic = time(lambda: quadratic_get_breaks(events))
+
+        if intervals.NUMPY_AVAILABLE:
+            encoded = [ intervals.encode(i) for i in group ]
+            vectorized = time(lambda: intervals.get_gaps(encoded))
+        else:
+            vectorized = "-"
+
+        print(f"{count:>10} {len(events):>8} {sweep:>12} {quadratic:>15} {vectorized:>12}")
+
+    print()
+    print(f"{'members':>10} {'events':>8} {'sweep (ms)':>12} {'bitset (ms)':>12}")
+
+    week_start = datetime(2017, 4, 3, tzinfo=BRISBANE_TIME_ZONE)
+    week_end = week_start + timedelta(days=7)
+
+    for count in (10, 100, 500):
+        group = [ [ e for e in events if week_start <= e.start < week_end ]
+                  for events in group_calendars(count) ]
+        events = [ event for events in group for event in events ]
+        bitmaps = [ bitsets.encode_week(i, week_start) for i in group ]
+
+        def time(f) -> str:
+            return f"{min(timeit.repeat(f, number=1, repeat=5)) * 1000:.2f}"
+
+        sweep = time(lambda: get_breaks(events))
+        bitset = time(lambda: bitsets.get_gaps(bitmaps, week_start))
+
+        print(f"{count:>10} {len(events):>8} {sweep:>12} {bitset:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Generates realistic, but made up, data to benchmark against: UQ semester
+calendars, written the way Timetable Planner writes them, and friend graphs.
+
+Everything takes a `random.Random`, so that the same seed always makes the
+same data.
+"""
+
+# Builtins
+import hashlib
+import random
+from datetime import date, datetime, timedelta
+from typing import List, Set, Tuple
+
+SEMESTER_START = date(2017, 2, 27)
+"""
+The Monday of the first week of semester one, 2017, like the calendars in
+`backend/calendars`
+"""
+
+TEACHING_WEEKS = 13
+
+MID_SEMESTER_BREAK = 7
+"""
+How many teaching weeks come before the mid-semester break
+"""
+
+PREFIXES = ("CSSE", "COMP", "INFS", "DECO", "MATH", "STAT", "PHYS", "ECON", "LING", "BIOL")
+
+BUILDINGS = (1, 3, 7, 14, 23, 35, 49, 50, 63, 78)
+
+
+class Class(object):
+    """
+    A class that runs at the same time each week of semester, from `first_week`
+    """
+
+    def __init__(self, summary: str, location: str, weekday: int, hour: int,
+                 minutes: int, first_week: int) -> None:
+        self.summary = summary
+        self.location = location
+        self.weekday = weekday
+        self.hour = hour
+        self.minutes = minutes
+        self.first_week = first_week
+
+
+def make_timetable(rng: random.Random, courses: int = 4) -> List[Class]:
+    """
+    A lecture or two, a tutorial and maybe a practical for each of `courses`
+    courses, trying not to clash with each other
+    """
+    taken: Set[Tuple[int, int]] = set()
+    classes = []
+
+    def book(summary: str, minutes: int, first_week: int) -> None:
+        for _ in range(20):
+            weekday, hour = rng.randint(0, 4), rng.randint(8, 18)
+            hours = { (weekday, hour + i) for i in range(-(-minutes // 60)) }
+            if not hours & taken:
+                break
+        taken.update(hours)
+
+        location = f"Building {rng.choice(BUILDINGS)}, Room {rng.randint(101, 499)}"
+        classes.append(Class(summary, location, weekday, hour, minutes, first_week))
+
+    codes = { f"{rng.choice(PREFIXES)}{rng.randint(1, 3)}{rng.randint(0, 9)}{rng.randint(0, 9)}{rng.randint(0, 9)}"
+              for _ in range(courses * 2) }
+
+    for code in sorted(codes)[:courses]:
+        for _ in range(rng.randint(1, 2)):
+            book(f"{code} L01", rng.choice((50, 110)), 1)
+        book(f"{code} T{rng.randint(1, 9):02}", 50, 2)
+        if rng.random() < 0.5:
+            book(f"{code} P{rng.randint(1, 9):02}", 110, 2)
+
+    return classes
+
+
+def fold(line: str) -> str:
+    """
+    Folds a content line at 75 characters, like RFC 5545 asks
+    """
+    chunks = [ line[:75] ] + [ " " + line[i:i + 74] for i in range(75, len(line), 74) ]
+    return "\r\n".join(chunks)
+
+
+def escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+
+
+def make_semester_ics(rng: random.Random, courses: int = 4,
+                      start: date = SEMESTER_START, weeks: int = TEACHING_WEEKS) -> bytes:
+    """
+    A semester calendar, with a `VEVENT` per class per week, and a week off
+    for the mid-semester break
+    """
+    lines = [ "BEGIN:VCALENDAR", "VERSION:2.0", "CALSCALE:GREGORIAN", "PRODID:iCalendar-Ruby" ]
+    stamp = datetime.combine(start, datetime.min.time()).strftime("%Y%m%dT%H%M%S")
+    timetable = make_timetable(rng, courses)
+
+    for week in range(1, weeks + 1):
+        # The mid-semester break isn't a teaching week
+        offset = week if week > MID_SEMESTER_BREAK else week - 1
+
+        for i in timetable:
+            if week < i.first_week:
+                continue
+
+            day = start + timedelta(weeks=offset, days=i.weekday)
+            event_start = datetime(day.year, day.month, day.day, i.hour)
+            event_end = event_start + timedelta(minutes=i.minutes)
+            uid = hashlib.md5(f"{i.summary}{event_start}".encode()).hexdigest()
+
+            lines += [ "BEGIN:VEVENT",
+                       f"DTEND;TZID=Australia/Brisbane:{event_end.strftime('%Y%m%dT%H%M%S')}",
+                       f"DTSTAMP:{stamp}",
+                       f"DTSTART;TZID=Australia/Brisbane:{event_start.strftime('%Y%m%dT%H%M%S')}",
+                       f"LOCATION:{escape(i.location)}",
+                       "SEQUENCE:0",
+                       f"SUMMARY:{escape(i.summary)}",
+                       fold(f"UID:{uid}@bench.timetableplanner.production.app.uq.edu.au"),
+                       "END:VEVENT" ]
+
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(lines) + "\r\n").encode()
+
+
+def make_friend_graph(rng: random.Random, users: int, mean_friends: float) -> List[Tuple[int, int]]:
+    """
+    A random graph of `users` people, numbered from 0, with `mean_friends`
+    friends each on average. Each friendship is an (a, b) pair, with a < b.
+    """
+    target = min(int(users * mean_friends / 2), users * (users - 1) // 2)
+    edges: Set[Tuple[int, int]] = set()
+
+    while len(edges) < target:
+        a, b = rng.sample(range(users), 2)
+        edges.add((min(a, b), max(a, b)))
+
+    return sorted(edges)
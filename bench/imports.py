@@ -0,0 +1,98 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Times importing the app, and the libraries it leans on, each in a fresh
+interpreter, as that's most of the time it takes a gunicorn worker to boot.
+Also reports which of the slow libraries each import drags in.
+
+Results are printed as JSON, like `bench.suite`, so that runs on different
+commits can be compared:
+
+    python -m bench.imports > before.json
+    python -m bench.imports > after.json
+    python -m bench.imports --compare before.json after.json
+"""
+
+# Builtins
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+
+# Imports
+from bench.suite import compare, get_commit
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+MODULES = ("icalendar", "bs4", "backend.models", "app")
+
+SLOW_MODULES = ("icalendar", "bs4", "html5lib", "numpy", "requests")
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{ "seconds": seconds,
+                    "loaded": [ i for i in {slow!r} if i in sys.modules ] }}))
+"""
+
+
+def time_import(module: str) -> Tuple[float, List[str]]:
+    """
+    How long importing `module` takes in a new interpreter, and which of
+    `SLOW_MODULES` it loads
+    """
+    # An in-memory database, in case importing creates tables
+    env = dict(os.environ, DATABASE_URL="sqlite://")
+    output = subprocess.check_output(
+        [ sys.executable, "-c", SCRIPT.format(module=module, slow=SLOW_MODULES) ],
+        cwd=ROOT_DIR, env=env, stderr=subprocess.DEVNULL)
+
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    return result["seconds"], result["loaded"]
+
+
+def run(repeat: int) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, float]] = {}
+    loaded: Dict[str, List[str]] = {}
+
+    for module in MODULES:
+        runs = []
+        for _ in range(repeat):
+            seconds, loaded[module] = time_import(module)
+            runs.append(seconds * 1000)
+
+        results[f"import {module}"] = { "min_ms": round(min(runs), 3),
+                                        "median_ms": round(statistics.median(runs), 3),
+                                        "mean_ms": round(statistics.mean(runs), 3) }
+
+    return { "commit": get_commit(),
+             "python": platform.python_version(),
+             "params": { "repeat": repeat },
+             "loaded": loaded,
+             "results": results }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compares two earlier runs, instead of running")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    print(json.dumps(run(args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
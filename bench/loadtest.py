@@ -0,0 +1,324 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+A load test of a locally started gunicorn, to find out how many polling
+clients one worker can keep up with before we add dynos.
+
+It starts `bench.standin` in place of UQ and Timetable Planner, and gunicorn
+against a fresh database, then signs up `--users` simulated users through
+`/fb-login`, imports each a generated calendar, and befriends them along a
+generated friend graph. Every simulated client then polls what the Elm client
+polls, once every `--interval` seconds, `--concurrency` requests at a time,
+for `--duration` seconds:
+
+    python -m bench.loadtest --users 1000 --concurrency 50 --workers 1
+
+Prints the throughput, the p50, p95 and p99 latencies, and the error rate of
+each endpoint. Use `--url` to test a server that's already running, or
+`--database-url` to run against Postgres rather than SQLite.
+"""
+
+# Builtins
+import argparse
+import json
+import math
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# Libraries
+import requests
+
+# Imports
+from bench.generators import make_friend_graph
+from bench.standin import StandIn
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+MIX = ("/statuses", "/calendar", "/whats-due", "/profile")
+"""
+What each client asks for on every poll
+"""
+
+
+class Client(object):
+    """
+    A simulated user, with their own cookies, and the ETags their browser
+    would have cached
+    """
+
+    def __init__(self, index: int) -> None:
+        self.fb_user_id = f"load_{index}"
+        self.session = requests.Session()
+        self.etags: Dict[str, str] = {}
+        self.due = 0.0
+
+
+class Results(object):
+    """
+    The latency of every request, and whether it failed, by endpoint
+    """
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if failed:
+                self.errors[endpoint] += 1
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    The nearest-rank `p`th percentile of `values`, which must be sorted
+    """
+    if not values:
+        return 0.0
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def summarise(results: Results, elapsed: float) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    endpoints = sorted(results.latencies)
+
+    for endpoint in endpoints + [ "total" ]:
+        if endpoint == "total":
+            latencies = sorted(i for j in endpoints for i in results.latencies[j])
+            errors = sum(results.errors.values())
+        else:
+            latencies = sorted(results.latencies[endpoint])
+            errors = results.errors[endpoint]
+
+        summary[endpoint] = { "requests": len(latencies),
+                              "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+                              "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                              "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                              "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                              "error_rate": round(errors / len(latencies), 4) if latencies else 0.0 }
+
+    return summary
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, worker_class: str,
+                 env: Dict[str, str]) -> subprocess.Popen:
+    """
+    Creates the database, then starts gunicorn, and waits for it to answer
+    """
+    subprocess.run([ sys.executable, "-m", "flask", "init-db" ], cwd=ROOT_DIR,
+                   env=dict(env, FLASK_APP="app.py"),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    server = subprocess.Popen([ "gunicorn", "app:app",
+                                "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+                                "--worker-class", worker_class, "--log-level", "warning" ],
+                              cwd=ROOT_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for _ in range(300):
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited while starting up")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/fb-app-id", timeout=5)
+            return server
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    server.terminate()
+    raise RuntimeError("gunicorn didn't start listening")
+
+
+def seed(url: str, clients: List[Client], friends: float, concurrency: int,
+         rng: random.Random) -> None:
+    """
+    Signs everyone up, imports their calendars, and befriends them, all
+    through the API, like the Elm client would
+    """
+    def sign_up(client: Client) -> None:
+        client.session.post(f"{url}/fb-login", json={ "userID": client.fb_user_id,
+                                                      "userName": client.fb_user_id,
+                                                      "email": f"{client.fb_user_id}@example.com",
+                                                      "accessToken": "fb_access_token" }).raise_for_status()
+
+        share_url = f"https://timetableplanner.app.uq.edu.au/share/{client.fb_user_id}.ics"
+        response = client.session.post(f"{url}/calendar", json={ "url": share_url })
+        response.raise_for_status()
+
+        job_url = f"{url}{response.headers['Location']}"
+        for _ in range(600):
+            response = client.session.get(job_url)
+            if response.status_code != 202:
+                break
+            time.sleep(0.1)
+        response.raise_for_status()
+
+    def befriend(a: Client, b: Client) -> None:
+        for me, friend in ((a, b), (b, a)):
+            me.session.post(f"{url}/add-friend", json={ "friendId": friend.fb_user_id,
+                                                        "remove": False }).raise_for_status()
+
+    def sync_fb_friends(client: Client, fb_friends: List[str]) -> None:
+        client.session.post(f"{url}/fb-friends", json={
+            "friends": [ { "id": i } for i in fb_friends ] }).raise_for_status()
+
+    edges = make_friend_graph(rng, len(clients), friends)
+    fb_friends: Dict[str, List[str]] = defaultdict(list)
+    for a, b in edges:
+        fb_friends[clients[a].fb_user_id].append(clients[b].fb_user_id)
+        fb_friends[clients[b].fb_user_id].append(clients[a].fb_user_id)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(sign_up, clients))
+        list(pool.map(lambda i: sync_fb_friends(i, fb_friends[i.fb_user_id]), clients))
+        list(pool.map(lambda i: befriend(clients[i[0]], clients[i[1]]), edges))
+
+
+def poll(url: str, client: Client, results: Results) -> None:
+    """
+    Makes one round of the client's requests, revalidating with ETags where
+    the server gave us one
+    """
+    for endpoint in MIX:
+        headers = {}
+        if endpoint in client.etags:
+            headers["If-None-Match"] = client.etags[endpoint]
+
+        start = time.perf_counter()
+        try:
+            response = client.session.get(f"{url}{endpoint}", headers=headers, timeout=30)
+            failed = response.status_code >= 400
+            if "ETag" in response.headers:
+                client.etags[endpoint] = response.headers["ETag"]
+        except requests.RequestException:
+            failed = True
+        results.record(endpoint, time.perf_counter() - start, failed)
+
+
+def run_load(url: str, clients: List[Client], concurrency: int, interval: float,
+             duration: float, rng: random.Random) -> Tuple[Results, float]:
+    """
+    Polls with each client every `interval` seconds, staggered, with at most
+    `concurrency` clients polling at once. A client that falls behind polls
+    again straight away, so once the server can't keep up, this measures how
+    much it can do.
+    """
+    start = time.monotonic()
+    deadline = start + duration
+    due: "queue.Queue[Client]" = queue.Queue()
+
+    for client in clients:
+        client.due = start + rng.uniform(0, interval)
+    for client in sorted(clients, key=lambda i: i.due):
+        due.put(client)
+
+    results = Results()
+
+    def work() -> None:
+        while True:
+            client = due.get()
+            if client.due >= deadline:
+                due.put(client) # So that the other workers see it too
+                return
+
+            time.sleep(max(client.due - time.monotonic(), 0))
+            poll(url, client, results)
+            client.due += interval
+            due.put(client)
+
+    threads = [ threading.Thread(target=work, daemon=True) for _ in range(concurrency) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results, time.monotonic() - start
+
+
+def report(summary: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'endpoint':>12} {'requests':>9} {'req/s':>8} {'p50 (ms)':>9} "
+          f"{'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+
+    for endpoint, i in summary.items():
+        print(f"{endpoint:>12} {i['requests']:>9} {i['rps']:>8.1f} {i['p50_ms']:>9.1f} "
+              f"{i['p95_ms']:>9.1f} {i['p99_ms']:>9.1f} {i['error_rate'] * 100:>6.2f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--friends", type=float, default=20,
+                        help="How many friends each user has, on average")
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="How many requests to have in flight at once")
+    parser.add_argument("--interval", type=float, default=60,
+                        help="Seconds between each client's polls, like the Elm client's tick")
+    parser.add_argument("--duration", type=float, default=120)
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--database-url",
+                        help="Where gunicorn keeps its data. Defaults to a fresh SQLite file")
+    parser.add_argument("--url", help="Tests this server, rather than starting gunicorn")
+    parser.add_argument("--upstream-latency", type=float, default=0.05,
+                        help="Seconds the stand-in for UQ takes to answer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also writes the results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    standin = StandIn(latency=args.upstream_latency, seed=args.seed).start()
+    server: Optional[subprocess.Popen] = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            url = args.url
+            if url is None:
+                port = get_free_port()
+                env = dict(os.environ,
+                           DATABASE_URL=args.database_url or f"sqlite:///{directory}/loadtest.db",
+                           UQ_URL=standin.url, UQ_COURSES_URL=standin.url,
+                           TIMETABLE_PLANNER_URL=standin.url)
+                server = start_server(port, args.workers, args.worker_class, env)
+                url = f"http://127.0.0.1:{port}"
+
+            clients = [ Client(i) for i in range(args.users) ]
+            print(f"Seeding {args.users} users at {url}", file=sys.stderr)
+            seed(url, clients, args.friends, args.concurrency, rng)
+
+            print(f"Polling for {args.duration:g}s", file=sys.stderr)
+            results, elapsed = run_load(url, clients, args.concurrency, args.interval,
+                                        args.duration, rng)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            standin.stop()
+
+    summary = summarise(results, elapsed)
+    report(summary)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({ "params": vars(args), "elapsed": round(elapsed, 3),
+                        "results": summary }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
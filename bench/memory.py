@@ -0,0 +1,67 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Measures how many bytes each user's cached `EventIndex` keeps alive, with the
+slotted, interned `Event_` against the dict-backed one it replaced.
+
+    python -m bench.memory
+"""
+
+# Builtins
+import gc
+import os
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable
+
+# Imports
+from backend import ics
+from backend.models import Event_, EventIndex
+from bench.breaks import CALENDARS_DIR
+
+
+class DictEvent(object):
+    """
+    The original, dict-backed `Event_`, kept as a baseline
+    """
+
+    def __init__(self, summary: str, location: str, start: datetime, end: datetime) -> None:
+        self.start = start
+        self.end = end
+        self.summary = summary
+        self.location = location
+
+
+def retained_bytes(build: Callable[[], Any]) -> int:
+    """
+    How many bytes the result of `build` holds on to once it's been built
+    """
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = build()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def main() -> None:
+    print(f"{'calendar':>10} {'events':>8} {'before (B)':>11} {'after (B)':>10} "
+          f"{'before (B/event)':>17} {'after (B/event)':>16}")
+
+    for name in ("max", "charlie", "hugo"):
+        with open(os.path.join(CALENDARS_DIR, f"{name}.ics"), "rb") as f:
+            data = f.read()
+
+        count = len(ics.parse_events(data))
+        before = retained_bytes(lambda: EventIndex([ DictEvent(*i) for i in ics.parse_events(data) ]))
+        after = retained_bytes(lambda: EventIndex([ Event_(*i) for i in ics.parse_events(data) ]))
+
+        print(f"{name:>10} {count:>8} {before:>11} {after:>10} "
+              f"{before // count:>17} {after // count:>16}")
+
+
+if __name__ == '__main__':
+    main()
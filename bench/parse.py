@@ -0,0 +1,58 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+Compares the parse time and peak memory of reading a semester calendar with
+`icalendar` ("strict") against `backend.ics` ("fast").
+
+    python -m bench.parse
+"""
+
+# Builtins
+import os
+import timeit
+import tracemalloc
+from typing import Any, Callable
+
+# Libraries
+from icalendar import Calendar # type: ignore
+
+# Imports
+from backend import ics
+from backend.models import Event_, get_events
+from bench.breaks import CALENDARS_DIR
+
+
+def strict(data: bytes) -> Any:
+    return get_events(Calendar.from_ical(data))
+
+
+def fast(data: bytes) -> Any:
+    return sorted((Event_(*i) for i in ics.parse_events(data)), key=lambda i: i.start)
+
+
+def peak_kib(f: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    f()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def main() -> None:
+    print(f"{'calendar':>10} {'events':>8} {'strict (ms)':>12} {'fast (ms)':>10} "
+          f"{'strict (KiB)':>13} {'fast (KiB)':>11}")
+
+    for name in ("max", "charlie", "hugo"):
+        with open(os.path.join(CALENDARS_DIR, f"{name}.ics"), "rb") as f:
+            data = f.read()
+
+        def time(f: Callable[[], Any]) -> str:
+            return f"{min(timeit.repeat(f, number=1, repeat=20)) * 1000:.2f}"
+
+        print(f"{name:>10} {len(fast(data)):>8} "
+              f"{time(lambda: strict(data)):>12} {time(lambda: fast(data)):>10} "
+              f"{peak_kib(lambda: strict(data)):>13.0f} {peak_kib(lambda: fast(data)):>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
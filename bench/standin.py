@@ -0,0 +1,246 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+A local stand-in for Timetable Planner and UQ's course pages, so that anything
+that downloads calendars or assessment can be benchmarked, and load tested,
+without the network, and with control over how slow or broken they are.
+
+    python -m bench.standin --port 8001 --latency 0.1 --error-rate 0.05
+
+    export TIMETABLE_PLANNER_URL=http://localhost:8001
+    export UQ_URL=http://localhost:8001
+    export UQ_COURSES_URL=http://localhost:8001
+
+It serves:
+    /share/<name>.ics
+        `backend/calendars/<name>.ics` if there is one, or else a semester
+        generated from `name`, with ETags
+    /study/course.html?course_code=<code>
+        A course page, linking to the course's profile
+    /student_section_report.php?report=assessment&profileIds=<id>
+        The assessment table of that profile
+"""
+
+# Builtins
+import argparse
+import hashlib
+import http.server
+import os
+import random
+import socketserver
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Tuple
+from urllib.parse import parse_qs, urlparse
+
+# Imports
+from bench.breaks import CALENDARS_DIR
+from bench.generators import SEMESTER_START, make_semester_ics
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return f.read()
+
+
+def get_profile_id(course: str) -> str:
+    """
+    Course codes are letters and digits, so reading them as base 36 gives us
+    all-digit profile ids that we can turn back into the course
+    """
+    return str(int(course, 36))
+
+
+def get_course(profile_id: str) -> str:
+    number = int(profile_id)
+    digits = []
+    while number:
+        number, digit = divmod(number, 36)
+        digits.append("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"[digit])
+    return "".join(reversed(digits))
+
+
+def make_assessment_rows(course: str) -> str:
+    """
+    Four pieces of assessment, spread over the semester, with due dates in
+    each of the formats UQ uses
+    """
+    rng = random.Random(course)
+    start = datetime.combine(SEMESTER_START, datetime.min.time())
+
+    def due(weeks: int) -> datetime:
+        return start + timedelta(weeks=weeks + rng.randint(0, 1), days=rng.randint(0, 4), hours=15)
+
+    first, mid, second = due(3), due(7), due(11)
+    pieces = [ ("Assignment 1", first.strftime("%d %b %y %H:%M"), "20%"),
+               ("Mid-semester Exam", mid.strftime("%d %b %Y : %H:%M"), "20%"),
+               ("Assignment 2", f"{(second - timedelta(weeks=2)).strftime('%d %b %y %H:%M')} - "
+                                f"{second.strftime('%d %b %y %H:%M')}", "20%"),
+               ("Final Exam", "Examination Period", "40%") ]
+
+    return "\n".join(f"    <tr><td>{course} (St Lucia)<br />Semester 1, 2017</td>"
+                     f"<td>{task}</td><td>{date}</td><td>{weight}</td></tr>"
+                     for task, date, weight in pieces)
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    server: 'StandIn'
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real thing
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests[url.path] += 1
+
+        if not self.server.inject_faults(self):
+            return
+
+        if url.path.startswith("/share/") and url.path.endswith(".ics"):
+            name = url.path[len("/share/"):-len(".ics")]
+            self.send_calendar(self.server.get_calendar(name))
+        elif url.path == "/study/course.html" and "course_code" in query:
+            code = query["course_code"][0].upper()
+            self.send_html(read_fixture("course.html").format(
+                code=code, profile_id=get_profile_id(code)))
+        elif url.path == "/student_section_report.php" and "profileIds" in query:
+            course = get_course(query["profileIds"][0])
+            self.send_html(read_fixture("assessment.html").format(rows=make_assessment_rows(course)))
+        else:
+            self.send_error(404)
+
+    def send_calendar(self, data: bytes) -> None:
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_html(self, html: str) -> None:
+        data = html.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: object) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StandIn(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    The stand-in server. Each request first waits `latency` seconds, plus up to
+    `jitter` more, then fails with `error_status` with a chance of
+    `error_rate`, or hangs for `slow_seconds` with a chance of `slow_rate`.
+
+    Every setting can be changed while the server is running. `requests`
+    counts the requests made to each path.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 slow_rate: float = 0.0, slow_seconds: float = 30.0, seed: int = 0,
+                 verbose: bool = False) -> None:
+        super().__init__((host, port), StandInHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.verbose = verbose
+        self.requests: Counter = Counter()
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._calendars = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def get_calendar(self, name: str) -> bytes:
+        with self._lock:
+            if name not in self._calendars:
+                path = os.path.join(CALENDARS_DIR, f"{name}.ics")
+                if os.path.exists(path) and name != "broken":
+                    with open(path, "rb") as f:
+                        self._calendars[name] = f.read()
+                else:
+                    self._calendars[name] = make_semester_ics(random.Random(name))
+
+            return self._calendars[name]
+
+    def roll(self) -> Tuple[float, float]:
+        with self._lock:
+            return self.rng.random(), self.rng.uniform(0, self.jitter)
+
+    def inject_faults(self, handler: StandInHandler) -> bool:
+        """
+        Delays, or fails, the request. Returns whether it should be answered.
+        """
+        chance, jitter = self.roll()
+        time.sleep(self.latency + jitter)
+
+        if chance < self.error_rate:
+            handler.send_error(self.error_status)
+            return False
+
+        if chance < self.error_rate + self.slow_rate:
+            time.sleep(self.slow_seconds)
+
+        return True
+
+    def start(self) -> 'StandIn':
+        """
+        Serves requests on a background thread
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to wait before answering each request")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Up to how many more seconds to wait, at random")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--slow-rate", type=float, default=0.0,
+                        help="The chance of a request hanging for --slow-seconds")
+    parser.add_argument("--slow-seconds", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = StandIn(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                     args.error_status, args.slow_rate, args.slow_seconds, args.seed,
+                     verbose=True)
+    print(f"Standing in for Timetable Planner and UQ at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
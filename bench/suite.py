@@ -0,0 +1,189 @@
+__author__ = "Maxwell Bo, Charlton Groves, Hugo Kawamata"
+
+"""
+An offline benchmark suite. Seeds an in-memory SQLite database with generated
+semesters and a generated friend graph, then times calendar parsing, breaks,
+statuses, and the `/statuses`, `/breaks` and `/fb-friends` endpoints, through
+Flask's test client.
+
+Results are printed as JSON, so that runs on different commits can be
+compared:
+
+    python -m bench.suite --users 200 --friends 20 > before.json
+    python -m bench.suite --users 200 --friends 20 > after.json
+    python -m bench.suite --compare before.json after.json
+"""
+
+# Builtins
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import timeit
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+# Libraries
+from icalendar import Calendar # type: ignore
+
+# Imports
+from app import app
+from backend import models
+from backend.models import (BRISBANE_TIME_ZONE, EvaluationContext, HasFriend, User, db,
+                            get_breaks, get_events, parse_calendar)
+from bench.generators import SEMESTER_START, make_friend_graph, make_semester_ics
+
+NOW = datetime(SEMESTER_START.year, SEMESTER_START.month, SEMESTER_START.day, 11,
+               tzinfo=BRISBANE_TIME_ZONE) + timedelta(weeks=3, days=2)
+"""
+Wednesday of week four, at 11am, so that everyone has uni, and some of it is
+still to come
+"""
+
+
+class FrozenDatetime(datetime):
+    """
+    A `datetime` that is always `NOW`, so that the endpoints see the same day
+    of semester whenever the suite is run
+    """
+
+    @classmethod
+    def now(cls, tz: Any = None) -> datetime:
+        return NOW.astimezone(tz) if tz is not None else NOW.replace(tzinfo=None)
+
+
+def seed(users: int, friends: float, courses: int, rng: random.Random) -> List[User]:
+    """
+    Adds `users` users, each with a generated semester, and befriends them
+    according to a generated friend graph. Everyone is also Facebook friends
+    with their friends, and with a couple of people they haven't added.
+    """
+    people = []
+    for i in range(users):
+        user = User(f"user_{i}", f"user_{i}@example.com", f"fb_{i}", "fb_access_token")
+        user.update_calendar(f"https://timetableplanner.app.uq.edu.au/share/bench_{i}.ics",
+                             make_semester_ics(rng, courses))
+        db.session.add(user)
+        people.append(user)
+    db.session.commit()
+
+    fb_friends: Dict[int, set] = { i: set() for i in range(users) }
+    for a, b in make_friend_graph(rng, users, friends):
+        db.session.add(HasFriend(f"fb_{a}", f"fb_{b}"))
+        db.session.add(HasFriend(f"fb_{b}", f"fb_{a}"))
+        fb_friends[a].add(f"fb_{b}")
+        fb_friends[b].add(f"fb_{a}")
+
+    for i, user in enumerate(people):
+        strangers = { f"fb_{rng.randrange(users)}" for _ in range(2) } - { user.fb_user_id }
+        user.sync_fb_friends(fb_friends[i] | strangers)
+    db.session.commit()
+
+    return people
+
+
+def time_ms(f: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    f() # Warms up the caches
+    runs = [ i * 1000 for i in timeit.repeat(f, number=1, repeat=repeat) ]
+    return { "min_ms": round(min(runs), 3),
+             "median_ms": round(statistics.median(runs), 3),
+             "mean_ms": round(statistics.mean(runs), 3) }
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output([ "git", "rev-parse", "HEAD" ],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(users: int, friends: float, courses: int, seed_: int, repeat: int) -> Dict[str, Any]:
+    rng = random.Random(seed_)
+    results: Dict[str, Dict[str, float]] = {}
+
+    with app.app_context(), mock.patch.object(models, "datetime", FrozenDatetime):
+        db.drop_all()
+        db.create_all()
+
+        people = seed(users, friends, courses, rng)
+        me = max(people, key=lambda i: len(i.confirmed_friends))
+        my_friends = me.confirmed_friends
+        data = me.calendar_data
+
+        results["get_events"] = time_ms(lambda: get_events(Calendar.from_ical(data)), repeat)
+        results["parse_calendar"] = time_ms(lambda: parse_calendar(data), repeat)
+
+        merged = [ event for user in [ me ] + my_friends for event in user.events ]
+        results["get_breaks"] = time_ms(lambda: get_breaks(merged), repeat)
+
+        results["User.status"] = time_ms(
+            lambda: [ i.get_status(EvaluationContext(NOW)) for i in my_friends ], repeat)
+        results["User.availability"] = time_ms(
+            lambda: [ i.availability(me, EvaluationContext(NOW)) for i in my_friends ], repeat)
+
+        client = app.test_client()
+        client.post("/fb-login", json={ "userID": me.fb_user_id, "userName": me.username,
+                                        "email": me.email, "accessToken": "fb_access_token" })
+        group = [ i.fb_user_id for i in my_friends[:5] ]
+
+        results["GET /statuses"] = time_ms(lambda: client.get("/statuses"), repeat)
+        results["POST /breaks"] = time_ms(
+            lambda: client.post("/breaks", json={ "friendIds": group }), repeat)
+        results["GET /fb-friends"] = time_ms(lambda: client.get("/fb-friends"), repeat)
+
+    return { "commit": get_commit(),
+             "python": platform.python_version(),
+             "params": { "users": users, "friends": friends, "courses": courses,
+                         "seed": seed_, "repeat": repeat,
+                         "my_friends": len(my_friends), "my_events": len(me.events) },
+             "results": results }
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> None:
+    """
+    Prints the change in each benchmark's median between two runs
+    """
+    print(f"{'benchmark':>20} {'before (ms)':>12} {'after (ms)':>12} {'change':>8}")
+
+    for name, result in after["results"].items():
+        if name not in before["results"]:
+            continue
+
+        old = before["results"][name]["median_ms"]
+        new = result["median_ms"]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"{name:>20} {old:>12.3f} {new:>12.3f} {change:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--friends", type=float, default=20,
+                        help="How many friends each user has, on average")
+    parser.add_argument("--courses", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compares two earlier runs, instead of running")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+    print(json.dumps(run(args.users, args.friends, args.courses, args.seed, args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
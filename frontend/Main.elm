@@ -1,4 +1,4 @@
-module Main exposing (..)
+port module Main exposing (..)
 
 import Debug
 import Time exposing (Time)
@@ -279,6 +279,16 @@ update msg model =
         CloseViewSharedBreaks ->
             { model | breaksPopup = Nothing } ! []
 
+        StatusChange change ->
+            let
+                apply friendInfo =
+                    if friendInfo.fbId == change.fbId then
+                        { friendInfo | status = change.status, statusInfo = change.statusInfo }
+                    else
+                        friendInfo
+            in
+                { model | friendsInfo = Maybe.map (List.map apply) model.friendsInfo } ! []
+
 
 
 {--
@@ -288,6 +298,14 @@ update msg model =
 --}
 
 
+{-| Fed by an `EventSource` on `/statuses/stream`, in app.html
+-}
+port statusChanges : (FriendStatus -> msg) -> Sub msg
+
+
 subscriptions : Model -> Sub Msg
 subscriptions model =
-    Time.every Time.minute Tick
+    Sub.batch
+        [ Time.every Time.minute Tick
+        , statusChanges StatusChange
+        ]
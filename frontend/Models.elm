@@ -19,6 +19,7 @@ type Msg
     | DeleteCalendar
     | OpenViewSharedBreaks FriendInfo
     | CloseViewSharedBreaks
+    | StatusChange FriendStatus
     | GetCalendarResponse (Result Http.Error Calendar)
     | PostCalendarResponse (Result Http.Error Calendar)
     | GetPostFriendRequestResponse (Result Http.Error String)
@@ -76,18 +77,29 @@ type alias Settings =
    FriendInfo Example
    dp: "graph.facebook.com/1827612378/images"
    name: "Charlie Groves"
+   fbId: "1827612378"
    status: "Free"
    statusInfo: "until 3pm"
 -}
 type alias FriendInfo =
     { dp : String
     , name : String
+    , fbId : String
     , status : String
     , statusInfo : String
     , breaks : Breaks
     }
 
 
+{-| A FriendInfo's new status, pushed to us by `/statuses/stream`
+-}
+type alias FriendStatus =
+    { fbId : String
+    , status : String
+    , statusInfo : String
+    }
+
+
 type alias Break =
     { start : String
     , end : String
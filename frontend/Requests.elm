@@ -4,6 +4,9 @@ import Http
 import Json.Decode as Decode exposing (Decoder)
 import Json.Encode as Encode
 import Models exposing (..)
+import Process
+import Task exposing (Task)
+import Time
 
 
 {-| http://package.elm-lang.org/packages/elm-lang/http/1.0.0/Http
@@ -82,10 +85,56 @@ postCalendarURL url =
             <|
                 [ ( "url", Encode.string url ) ]
 
+        jobDecoder =
+            Decode.at [ "data", "id" ] <| Decode.string
+    in
+        Http.post endpoint body jobDecoder
+            |> Http.toTask
+            |> Task.andThen (pollCalendarJob 0)
+            |> Task.attempt PostCalendarResponse
+
+
+{-| How many times we poll a calendar import before giving up on it. With the
+backoff below, that's a little over three minutes, by which time the server
+will have given up on it too.
+-}
+calendarJobAttempts : Int
+calendarJobAttempts =
+    40
+
+
+{-| The calendar is downloaded in the background, so we poll its job until
+the server responds with our timetable, backing off from half a second to
+five seconds between polls. Fails with a `Http.Timeout` if the job never
+finishes.
+-}
+pollCalendarJob : Int -> String -> Task Http.Error Calendar
+pollCalendarJob attempt jobId =
+    let
+        endpoint =
+            "/calendar/jobs/" ++ jobId
+
         decoder =
-            Decode.at [ "data" ] <| Decode.string
+            Decode.oneOf [ Decode.map Just calendarDecoder, Decode.succeed Nothing ]
+
+        delay =
+            min (5 * Time.second) (500 * Time.millisecond * toFloat (2 ^ min attempt 4))
+
+        retry result =
+            case result of
+                Just calendar ->
+                    Task.succeed calendar
+
+                Nothing ->
+                    if attempt + 1 >= calendarJobAttempts then
+                        Task.fail Http.Timeout
+                    else
+                        Process.sleep delay
+                            |> Task.andThen (\_ -> pollCalendarJob (attempt + 1) jobId)
     in
-        Http.send PostCalendarResponse <| Http.post endpoint body calendarDecoder
+        Http.get endpoint decoder
+            |> Http.toTask
+            |> Task.andThen retry
 
 
 postFriendRequest : AddFriendInfoPiece -> Cmd Msg
@@ -199,9 +248,10 @@ getFriendsInfo =
 
         friendInfoDecoder : Decoder FriendInfo
         friendInfoDecoder =
-            Decode.map5 FriendInfo
+            Decode.map6 FriendInfo
                 (Decode.field "dp" Decode.string)
                 (Decode.field "name" Decode.string)
+                (Decode.field "fbId" Decode.string)
                 (Decode.field "status" Decode.string)
                 (Decode.field "statusInfo" Decode.string)
                 (Decode.field "breaks" (Decode.list breakDecoder))
@@ -0,0 +1,40 @@
+"""Add the Events table
+
+Revision ID: 3f1c2a7b9d10
+Revises: 
+Create Date: 2026-10-18 10:12:41.201833
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7b9d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `db.create_all()` runs whenever `app.py` is imported, so the table may
+    # well exist by the time this migration gets a look in
+    if 'Events' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('Events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('summary', sa.String(length=256), nullable=True),
+    sa.Column('location', sa.String(length=256), nullable=True),
+    sa.Column('start', sa.DateTime(), nullable=False),
+    sa.Column('end', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['Users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Events_user_id_start', 'Events', ['user_id', 'start'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Events_user_id_start', table_name='Events')
+    op.drop_table('Events')
@@ -0,0 +1,78 @@
+"""Move Users.fb_friends into the FacebookFriends table
+
+Revision ID: 8c4e0f2d6a51
+Revises: 3f1c2a7b9d10
+Create Date: 2026-10-18 13:47:05.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e0f2d6a51'
+down_revision = '3f1c2a7b9d10'
+branch_labels = None
+depends_on = None
+
+
+users = sa.table('Users',
+    sa.column('id', sa.Integer),
+    sa.column('fb_user_id', sa.String),
+    sa.column('fb_friends', sa.LargeBinary)
+)
+
+facebook_friends = sa.table('FacebookFriends',
+    sa.column('user_id', sa.Integer),
+    sa.column('fb_friend_id', sa.String)
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # `db.create_all()` may have beaten us to it
+    if 'FacebookFriends' not in inspector.get_table_names():
+        op.create_table('FacebookFriends',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('fb_friend_id', sa.String(length=128), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['Users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'fb_friend_id')
+        )
+        op.create_index(op.f('ix_FacebookFriends_fb_friend_id'), 'FacebookFriends',
+                        ['fb_friend_id'], unique=False)
+
+    if 'fb_friends' not in [ i['name'] for i in inspector.get_columns('Users') ]:
+        return
+
+    rows = []
+    for user_id, fb_user_id, blob in bind.execute(
+            users.select().where(users.c.fb_friends != None)):
+        friend_ids = { i for i in bytes(blob).decode().split(",") if i != "" }
+        friend_ids.discard(fb_user_id)
+        rows.extend({ 'user_id': user_id, 'fb_friend_id': i } for i in friend_ids)
+
+    if rows:
+        op.bulk_insert(facebook_friends, rows)
+
+    with op.batch_alter_table('Users') as batch_op:
+        batch_op.drop_column('fb_friends')
+
+
+def downgrade():
+    bind = op.get_bind()
+
+    with op.batch_alter_table('Users') as batch_op:
+        batch_op.add_column(sa.Column('fb_friends', sa.LargeBinary(), nullable=True))
+
+    friends = {}
+    for user_id, fb_friend_id in bind.execute(facebook_friends.select()):
+        friends.setdefault(user_id, []).append(fb_friend_id)
+
+    for user_id, friend_ids in friends.items():
+        bind.execute(users.update().where(users.c.id == user_id)
+                          .values(fb_friends=",".join(friend_ids).encode()))
+
+    op.drop_index(op.f('ix_FacebookFriends_fb_friend_id'), table_name='FacebookFriends')
+    op.drop_table('FacebookFriends')
@@ -0,0 +1,34 @@
+"""Add the validators of the last calendar download to Users
+
+Revision ID: b71d93e0c4f2
+Revises: 8c4e0f2d6a51
+Create Date: 2026-10-18 15:20:33.640912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d93e0c4f2'
+down_revision = '8c4e0f2d6a51'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `db.create_all()` doesn't add columns to existing tables, but a fresh
+    # database will have them already
+    columns = [ i['name'] for i in sa.inspect(op.get_bind()).get_columns('Users') ]
+
+    with op.batch_alter_table('Users') as batch_op:
+        if 'calendar_etag' not in columns:
+            batch_op.add_column(sa.Column('calendar_etag', sa.String(length=256), nullable=True))
+        if 'calendar_last_modified' not in columns:
+            batch_op.add_column(sa.Column('calendar_last_modified', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('Users') as batch_op:
+        batch_op.drop_column('calendar_last_modified')
+        batch_op.drop_column('calendar_etag')
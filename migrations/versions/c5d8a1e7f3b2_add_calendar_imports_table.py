@@ -0,0 +1,41 @@
+"""Add the CalendarImports table
+
+Revision ID: c5d8a1e7f3b2
+Revises: b71d93e0c4f2
+Create Date: 2026-10-18 16:02:17.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d8a1e7f3b2'
+down_revision = 'b71d93e0c4f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `db.create_all()` runs whenever `app.py` is imported, so the table may
+    # well exist by the time this migration gets a look in
+    if 'CalendarImports' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('CalendarImports',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('url', sa.String(length=512), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('error', sa.String(length=256), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=True),
+    sa.Column('finished', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['Users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_CalendarImports_user_id'), 'CalendarImports', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_CalendarImports_user_id'), table_name='CalendarImports')
+    op.drop_table('CalendarImports')
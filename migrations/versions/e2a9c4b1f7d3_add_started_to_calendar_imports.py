@@ -0,0 +1,31 @@
+"""Add when each calendar import started running to CalendarImports
+
+Revision ID: e2a9c4b1f7d3
+Revises: c5d8a1e7f3b2
+Create Date: 2026-10-18 17:02:11.208374
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a9c4b1f7d3'
+down_revision = 'c5d8a1e7f3b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `db.create_all()` doesn't add columns to existing tables, but a fresh
+    # database will have them already
+    columns = [ i['name'] for i in sa.inspect(op.get_bind()).get_columns('CalendarImports') ]
+
+    with op.batch_alter_table('CalendarImports') as batch_op:
+        if 'started' not in columns:
+            batch_op.add_column(sa.Column('started', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('CalendarImports') as batch_op:
+        batch_op.drop_column('started')
@@ -1 +1 @@
-elm-make frontend/Main.elm --output=static/app.js && python3 app.py
+elm-make frontend/Main.elm --output=static/app.js && FLASK_APP=app.py python3 -m flask init-db && python3 app.py